@@ -0,0 +1,187 @@
+# backend/audit.py
+import json
+import os
+import sqlite3
+import threading
+import time
+from dotenv import load_dotenv
+
+# ─── CONFIGURATION ────────────────────────────────────────────────────────────
+load_dotenv()
+# SQLite file holding the audit log (relative paths are from the working
+# directory). In the cluster, deployment.yaml points it at the persistent volume.
+AUDIT_DB_PATH = os.environ.get("AUDIT_DB_PATH", "audit.db")
+
+# ─── STORAGE ──────────────────────────────────────────────────────────────────
+#
+# One row per changed flag. Rows are only ever inserted (UPDATE/DELETE are
+# rejected by triggers), so id order is also time order and doubles as the
+# pagination cursor. Each filter has an index ending in id, so a filtered page
+# is an index range scan no matter how many rows the log holds. Time ranges
+# are turned into id bounds first (one lookup each on audit_ts), so they
+# narrow the same scans instead of forcing a sort.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS audit (
+    id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts       REAL NOT NULL,
+    user     TEXT NOT NULL,
+    project  TEXT NOT NULL,
+    env      TEXT,
+    cluster  TEXT,
+    action   TEXT NOT NULL,
+    flag     TEXT NOT NULL,
+    before   TEXT,
+    after    TEXT
+);
+CREATE INDEX IF NOT EXISTS audit_flag ON audit (flag, id);
+CREATE INDEX IF NOT EXISTS audit_project ON audit (project, id);
+CREATE INDEX IF NOT EXISTS audit_project_env ON audit (project, env, id);
+CREATE INDEX IF NOT EXISTS audit_env ON audit (env, id);
+CREATE INDEX IF NOT EXISTS audit_user ON audit (user, id);
+CREATE INDEX IF NOT EXISTS audit_ts ON audit (ts);
+CREATE TRIGGER IF NOT EXISTS audit_no_update BEFORE UPDATE ON audit
+BEGIN SELECT RAISE(ABORT, 'audit log is append-only'); END;
+CREATE TRIGGER IF NOT EXISTS audit_no_delete BEFORE DELETE ON audit
+BEGIN SELECT RAISE(ABORT, 'audit log is append-only'); END;
+"""
+
+_MAX_ID = 2 ** 63 - 1
+
+_local = threading.local()
+_schema_mutex = threading.Lock()
+_schema_ready = False
+
+
+def _connect() -> sqlite3.Connection:
+    """
+    One connection per thread (FastAPI runs sync routes on a thread pool).
+    """
+    global _schema_ready
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        return conn
+
+    os.makedirs(os.path.dirname(AUDIT_DB_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(AUDIT_DB_PATH, timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    with _schema_mutex:
+        if not _schema_ready:
+            conn.executescript(_SCHEMA)
+            # Logs created before the cluster column existed
+            if "cluster" not in {row["name"] for row in conn.execute("PRAGMA table_info(audit)")}:
+                conn.execute("ALTER TABLE audit ADD COLUMN cluster TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS audit_cluster ON audit (cluster, id)")
+            _schema_ready = True
+    _local.conn = conn
+    return conn
+
+
+def init() -> None:
+    """
+    Open the log (creating it and its schema if needed). Called at startup so a
+    path that can't be written fails the start instead of dropping entries later.
+    """
+    _connect()
+
+
+def record(user: str, project: str, env: str | None, action: str,
+           changes: list[tuple[str, object, object]], cluster: str | None = None) -> None:
+    """
+    Append one entry per (flag, before, after) in changes.
+    action is what happened: "update" (env patch file commit), "add" (flags.yaml
+    commit) or "live-patch" (FeatureFlag CR patched directly in cluster; cluster
+    is None for Git writes).
+    Failures are logged and swallowed so they never fail the change itself.
+    """
+    if not changes:
+        return
+    now = time.time()
+    rows = [
+        (now, user, project, env, cluster, action, flag,
+         None if before is None else json.dumps(before, sort_keys=True),
+         None if after is None else json.dumps(after, sort_keys=True))
+        for flag, before, after in changes
+    ]
+    try:
+        conn = _connect()
+        with conn:
+            conn.executemany(
+                "INSERT INTO audit (ts, user, project, env, cluster, action, flag, before, after)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+    except Exception as e:
+        print(f"[ERROR] Failed to write audit log: {e}")
+
+
+def _first_id_at(conn: sqlite3.Connection, ts: float) -> int:
+    """
+    id of the first entry written at or after ts (one past the last id if none).
+    """
+    row = conn.execute("SELECT id FROM audit WHERE ts >= ? ORDER BY ts LIMIT 1", (ts,)).fetchone()
+    if row is not None:
+        return row[0]
+    return (conn.execute("SELECT MAX(id) FROM audit").fetchone()[0] or 0) + 1
+
+
+def query(flag: str | None = None, project: str | None = None, env: str | None = None,
+          user: str | None = None, cluster: str | None = None, since: float | None = None, until: float | None = None,
+          cursor: int | None = None, limit: int = 50,
+          access=None) -> dict:
+    """
+    Newest-first page of audit entries matching every given filter and, when
+    given, visible to access (a git_utils.Access). Pass the returned
+    next_cursor back as cursor to get the following page.
+    """
+    conn = _connect()
+    clauses, params = [], []
+    for column, value in (("flag", flag), ("project", project), ("env", env), ("user", user),
+                          ("cluster", cluster)):
+        if value is not None:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    if since is not None:
+        clauses.append("id >= ?")
+        params.append(_first_id_at(conn, since))
+    if until is not None:
+        clauses.append("id < ?")
+        params.append(_first_id_at(conn, until))
+    if access is not None:
+        if not access.projects:
+            return {"entries": [], "next_cursor": None}
+        clauses.append(f"project IN ({', '.join('?' * len(access.projects))})")
+        params.extend(sorted(access.projects))
+    clauses.append("id < ?")
+
+    sql = "SELECT * FROM audit WHERE " + " AND ".join(clauses) + " ORDER BY id DESC LIMIT ?"
+    # Rows in envs the caller can't see are skipped, so keep reading (growing)
+    # batches until the page is full, plus one row to know if there is a next page.
+    rows, before, batch_size = [], cursor if cursor is not None else _MAX_ID, limit + 1
+    while len(rows) <= limit:
+        batch = conn.execute(sql, params + [before, batch_size]).fetchall()
+        rows.extend(row for row in batch if access is None or access.can_see(row["project"], row["env"]))
+        if len(batch) < batch_size:
+            break
+        before = batch[-1]["id"]
+        batch_size = min(batch_size * 2, 5000)
+
+    entries = [
+        {
+            "id": row["id"],
+            "ts": row["ts"],
+            "user": row["user"],
+            "project": row["project"],
+            "env": row["env"],
+            "cluster": row["cluster"],
+            "action": row["action"],
+            "flag": row["flag"],
+            "before": None if row["before"] is None else json.loads(row["before"]),
+            "after": None if row["after"] is None else json.loads(row["after"]),
+        }
+        for row in rows[:limit]
+    ]
+    next_cursor = entries[-1]["id"] if len(rows) > limit else None
+    return {"entries": entries, "next_cursor": next_cursor}
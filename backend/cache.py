@@ -0,0 +1,95 @@
+# backend/cache.py
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+# ─── CONFIGURATION ────────────────────────────────────────────────────────────
+load_dotenv()
+# How long (seconds) an upstream read is served from memory before we go back
+# to GitLab / Kubernetes for it.
+CACHE_TTL = float(os.environ.get("CACHE_TTL", "30"))
+
+# ─── STORE ────────────────────────────────────────────────────────────────────
+
+# key -> (value, version, stored_at)
+# Keys are small tuples, e.g. ("project_id",), ("tree", "expense-manager-backend"),
+# ("codeowners",), ("file", "<encoded path>"), ("cr", "<cluster>", "<env>").
+# version is whatever lets us cheaply revalidate the entry later
+# (GitLab last_commit_id, k8s resourceVersion) or None.
+# Cached values are shared between requests: treat them as read-only.
+_entries: dict[tuple, tuple] = {}
+_entries_mutex = threading.Lock()
+
+
+def get(key: tuple, max_age: float | None = CACHE_TTL):
+    """
+    Return the cached value for key, or None if missing or older than max_age.
+    Pass max_age=None for values that never change (e.g. the numeric project ID).
+    """
+    with _entries_mutex:
+        entry = _entries.get(key)
+    if entry is None:
+        return None
+    value, _version, stored_at = entry
+    if max_age is not None and time.time() - stored_at > max_age:
+        return None
+    return value
+
+
+def get_version(key: tuple) -> str | None:
+    """
+    Return the version recorded with key (regardless of age), or None.
+    """
+    with _entries_mutex:
+        entry = _entries.get(key)
+    return entry[1] if entry else None
+
+
+def put(key: tuple, value, version: str | None = None) -> None:
+    if value is None:
+        return
+    with _entries_mutex:
+        _entries[key] = (value, version, time.time())
+
+
+def touch(key: tuple) -> None:
+    """
+    Mark an entry as fresh again without replacing it (it was revalidated).
+    """
+    with _entries_mutex:
+        entry = _entries.get(key)
+        if entry is not None:
+            _entries[key] = (entry[0], entry[1], time.time())
+
+
+def invalidate(key: tuple) -> None:
+    with _entries_mutex:
+        _entries.pop(key, None)
+
+
+def keys(kind: str) -> list[tuple]:
+    """
+    All keys whose first element is kind, e.g. keys("file").
+    """
+    with _entries_mutex:
+        return [k for k in _entries if k[0] == kind]
+
+
+def dump() -> list[tuple]:
+    """
+    Copy of every entry as (key, value, version), used by snapshot.write().
+    """
+    with _entries_mutex:
+        return [(k, v, ver) for k, (v, ver, _stored_at) in _entries.items()]
+
+
+def load(entries: list[tuple]) -> None:
+    """
+    Restore entries produced by dump(). They are stamped as fresh so they are
+    served straight away; snapshot.py revalidates them in the background.
+    """
+    now = time.time()
+    with _entries_mutex:
+        for key, value, version in entries:
+            _entries.setdefault(key, (value, version, now))
@@ -0,0 +1,129 @@
+# backend/change_feed.py
+import os
+import threading
+from typing import Callable
+from dotenv import load_dotenv
+import git_utils
+import k8s_utils
+
+# ─── CONFIGURATION ────────────────────────────────────────────────────────────
+load_dotenv()
+# Seconds between checks for new commits on the flags repo (also the back-off
+# before re-opening a FeatureFlag watch that failed).
+CHANGE_POLL_INTERVAL = float(os.environ.get("CHANGE_POLL_INTERVAL", "30"))
+# When to start following FeatureFlag CRs: "lazy" (on the first k8s call, so
+# startup never loads the Kubernetes client), "true" (at startup) or "false".
+K8S_WATCH = os.environ.get("K8S_WATCH", "lazy").lower()
+
+# One place that follows the flags repo and the cluster, so every in-memory
+# view (search index, drift detection, ...) is updated from the same events
+# instead of each one polling GitLab and watching k8s on its own.
+#
+# Git subscribers get resync() once at start (and again after any of their
+# handlers failed), then on_change(path, deleted) for every file touched by
+# new commits on BRANCH. The cached copy of a changed file is dropped before
+# subscribers are told, so their reads see the new content.
+# Cluster subscribers get (event type, env, flags) for every FeatureFlag
+# watch event, including DELETED for CRs found missing when the watch has to
+# list again.
+
+
+class _GitSubscriber:
+    def __init__(self, resync: Callable[[], None], on_change: Callable[[str, bool], None]):
+        self.resync = resync
+        self.on_change = on_change
+        self.stale = True
+
+
+_git_subscribers: list[_GitSubscriber] = []
+_cluster_subscribers: list[Callable[[str, str, dict], None]] = []
+_stop = threading.Event()
+_threads: list[threading.Thread] = []
+_threads_mutex = threading.Lock()
+
+
+def subscribe_git(resync: Callable[[], None], on_change: Callable[[str, bool], None]) -> None:
+    _git_subscribers.append(_GitSubscriber(resync, on_change))
+
+
+def subscribe_cluster(on_event: Callable[[str, str, dict], None]) -> None:
+    _cluster_subscribers.append(on_event)
+
+
+def _follow_git() -> None:
+    head = None
+    while not _stop.is_set():
+        try:
+            new_head = git_utils.get_branch_head(git_utils.FLAG_PAT)
+            changed = []
+            if head is not None and new_head != head:
+                changed = git_utils.get_changed_paths(head, new_head, git_utils.FLAG_PAT)
+                for path, _deleted in changed:
+                    git_utils.invalidate_file(path)
+
+            for subscriber in _git_subscribers:
+                try:
+                    if subscriber.stale:
+                        subscriber.resync()
+                        subscriber.stale = False
+                    else:
+                        for path, deleted in changed:
+                            subscriber.on_change(path, deleted)
+                except Exception as e:
+                    print(f"Change feed subscriber error: {e}")
+                    subscriber.stale = True
+            head = new_head
+        except Exception as e:
+            print(f"Change feed git error: {e}")
+        _stop.wait(CHANGE_POLL_INTERVAL)
+
+
+def _follow_cluster() -> None:
+    while not _stop.is_set():
+        try:
+            for event_type, env, flags in k8s_utils.watch_flags():
+                for on_event in _cluster_subscribers:
+                    try:
+                        on_event(event_type, env, flags)
+                    except Exception as e:
+                        print(f"Change feed subscriber error: {e}")
+                if _stop.is_set():
+                    return
+        except Exception as e:
+            # Only back off on errors; a watch that simply timed out resumes at once
+            print(f"Change feed watch error: {e}")
+            _stop.wait(CHANGE_POLL_INTERVAL)
+
+
+def _start_thread(target, name: str) -> None:
+    with _threads_mutex:
+        if _stop.is_set() or any(thread.name == name for thread in _threads):
+            return
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        _threads.append(thread)
+
+
+def _start_cluster_follower() -> None:
+    _start_thread(_follow_cluster, "change-feed-k8s")
+
+
+def start() -> None:
+    """
+    Start following BRANCH on a background thread, and the FeatureFlag watch
+    as K8S_WATCH says. Subscribe before calling this.
+    """
+    if _threads:
+        return
+    _stop.clear()
+    _start_thread(_follow_git, "change-feed-git")
+    if K8S_WATCH == "true":
+        _start_cluster_follower()
+    elif K8S_WATCH == "lazy":
+        k8s_utils.on_first_use(_start_cluster_follower)
+
+
+def stop() -> None:
+    _stop.set()
+    with _threads_mutex:
+        _threads.clear()
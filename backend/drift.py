@@ -0,0 +1,209 @@
+# backend/drift.py
+import hashlib
+import json
+import threading
+from typing import Callable
+import jsonpatch
+import change_feed
+import git_utils
+import k8s_utils
+import metrics
+
+# Git-vs-cluster drift detection.
+#
+# For every env we keep, per side, {flag: content hash} plus one digest over
+# those hashes. Git's side is feature-flags.yaml with feature-flags-patch.yaml
+# merged on top (what kustomize/Flux should apply); the cluster's side is the
+# live FeatureFlag CR. Equal digests mean the env is in sync and nothing else
+# is compared; otherwise only flags whose hashes differ get a JSON patch.
+# Both sides are updated from change_feed events, and only the env an event
+# touched is reconciled again. Until the FeatureFlag watch has listed the
+# cluster once, envs with no CR yet are not reported as missing_in_cluster.
+
+IN_SYNC = "in_sync"
+DRIFTED = "drifted"
+MISSING_IN_CLUSTER = "missing_in_cluster"
+MISSING_IN_GIT = "missing_in_git"
+
+
+class _Side:
+    """
+    One env's flags as seen by Git or by the cluster.
+    """
+    __slots__ = ("flags", "hashes", "digest")
+
+    def __init__(self, flags: dict[str, dict]):
+        self.flags = flags
+        self.hashes = {flag: _hash(definition) for flag, definition in flags.items()}
+        self.digest = hashlib.blake2b(
+            "\n".join(f"{flag}\0{h}" for flag, h in sorted(self.hashes.items())).encode(),
+            digest_size=16,
+        ).hexdigest()
+
+
+def _hash(definition) -> str:
+    canonical = json.dumps(definition, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+
+_git: dict[str, _Side] = {}
+_cluster: dict[str, _Side] = {}
+_env_projects: dict[str, str] = {}
+_drift: dict[str, dict] = {}
+_drift_mutex = threading.RLock()
+_ready = threading.Event()
+_started = False
+
+
+def _reconcile(env: str) -> None:
+    """
+    Recompute the drift report for one env. Caller holds _drift_mutex.
+    """
+    git, cluster = _git.get(env), _cluster.get(env)
+    if git is None and cluster is None:
+        _drift.pop(env, None)
+        return
+    if git is not None and cluster is not None and git.digest == cluster.digest:
+        _drift.pop(env, None)
+        return
+
+    if cluster is None:
+        status, flags = MISSING_IN_CLUSTER, []
+    elif git is None:
+        status, flags = MISSING_IN_GIT, []
+    else:
+        status, flags = DRIFTED, []
+        for flag in sorted(git.hashes.keys() | cluster.hashes.keys()):
+            git_hash, cluster_hash = git.hashes.get(flag), cluster.hashes.get(flag)
+            if git_hash == cluster_hash:
+                continue
+            flags.append({
+                "flag": flag,
+                "git": git.flags.get(flag),
+                "cluster": cluster.flags.get(flag),
+                # Operations that turn the Git definition into the live one
+                "patch": jsonpatch.make_patch(git.flags.get(flag) or {}, cluster.flags.get(flag) or {}).patch,
+            })
+
+    _drift[env] = {
+        "project": _env_projects.get(env),
+        "env": env,
+        "status": status,
+        "git_digest": git.digest if git else None,
+        "cluster_digest": cluster.digest if cluster else None,
+        "flags": flags,
+    }
+
+
+def _set_git(project: str, env: str, flags: dict | None) -> None:
+    with _drift_mutex:
+        _env_projects[env] = project
+        if flags is None:
+            _git.pop(env, None)
+        else:
+            _git[env] = _Side(flags)
+        _reconcile(env)
+
+
+def _read_git(project: str, env: str) -> dict | None:
+    """
+    Desired flags for (project, env): feature-flags.yaml with the patch file merged on top.
+    """
+    pat = git_utils.FLAG_PAT
+    base = git_utils.read_flags(project, env, pat)
+    patch = git_utils.read_patch_flags(project, env, pat)
+    if base is None and patch is None:
+        return None
+    return k8s_utils.merge_patch(base or {}, patch or {})
+
+
+def _resync() -> None:
+    pat = git_utils.FLAG_PAT
+    seen = set()
+    for project in git_utils.get_all_projects(pat):
+        for env in git_utils.get_all_envs(project, pat) or []:
+            _set_git(project, env, _read_git(project, env))
+            seen.add(env)
+    with _drift_mutex:
+        for env in list(_git.keys() - seen):
+            del _git[env]
+            _reconcile(env)
+    _ready.set()
+
+
+def _on_git_change(path: str, deleted: bool) -> None:
+    parts = path.split("/")
+    if len(parts) != 3 or parts[1] == "_template":
+        return
+    if parts[2] not in ("feature-flags.yaml", "feature-flags-patch.yaml"):
+        return
+    project, env = parts[0], parts[1]
+    _set_git(project, env, _read_git(project, env))
+
+
+def _on_cluster_event(event_type: str, env: str, flags: dict) -> None:
+    with _drift_mutex:
+        if event_type == "DELETED":
+            _cluster.pop(env, None)
+        else:
+            side = _Side(flags)
+            current = _cluster.get(env)
+            if current is not None and current.digest == side.digest:
+                return
+            _cluster[env] = side
+        _reconcile(env)
+
+
+def report(project: str | None = None, env: str | None = None, status: str | None = None,
+           visible: Callable[[str | None, str | None], bool] | None = None) -> list[dict]:
+    """
+    Current drift entries (envs not in sync), optionally filtered, keeping only
+    envs for which visible(project, env) is true when it is given.
+    """
+    cluster_synced = k8s_utils.watch_synced()
+    with _drift_mutex:
+        entries = [
+            entry for entry in _drift.values()
+            if (cluster_synced or entry["status"] != MISSING_IN_CLUSTER)
+            and (project is None or entry["project"] == project)
+            and (env is None or entry["env"] == env)
+            and (status is None or entry["status"] == status)
+            and (visible is None or visible(entry["project"], entry["env"]))
+        ]
+    return sorted(entries, key=lambda entry: (entry["project"] or "", entry["env"]))
+
+
+def is_ready() -> bool:
+    """
+    True once Git has been read in full at least once.
+    """
+    return _ready.is_set()
+
+
+def _drifted_envs() -> dict[tuple, int]:
+    counts = {(s,): 0 for s in (DRIFTED, MISSING_IN_CLUSTER, MISSING_IN_GIT)}
+    cluster_synced = k8s_utils.watch_synced()
+    with _drift_mutex:
+        for entry in _drift.values():
+            if cluster_synced or entry["status"] != MISSING_IN_CLUSTER:
+                counts[(entry["status"],)] += 1
+    return counts
+
+
+metrics.register(
+    "featureflags_drifted_envs", "gauge",
+    "Envs whose Git flags differ from the live FeatureFlag CR",
+    _drifted_envs, labels=("status",),
+)
+
+
+def start() -> None:
+    """
+    Follow Git and the cluster through change_feed.
+    """
+    global _started
+    if _started:
+        return
+    _started = True
+    change_feed.subscribe_git(_resync, _on_git_change)
+    change_feed.subscribe_cluster(_on_cluster_event)
@@ -0,0 +1,407 @@
+# backend/evaluator.py
+import threading
+import time
+import git_utils
+import k8s_utils
+
+# Server-side flag resolution with flagd semantics:
+#   - missing flag              → reason ERROR, errorCode FLAG_NOT_FOUND
+#   - state DISABLED            → reason DISABLED, errorCode FLAG_DISABLED (caller falls back to its code default)
+#   - no targeting              → reason STATIC, defaultVariant
+#   - targeting returns variant → reason TARGETING_MATCH
+#   - targeting returns null    → reason DEFAULT, defaultVariant
+#   - env not in the project, or its CR unreadable → reason ERROR, errorCode GENERAL
+# Targeting rules are JsonLogic plus flagd's custom operators (fractional, sem_ver,
+# starts_with, ends_with). Rules are compiled into Python closures once per flag
+# definition, so a batch only pays for walking the compiled rule.
+
+
+class EvaluationError(Exception):
+    def __init__(self, error_code: str, message: str):
+        super().__init__(message)
+        self.error_code = error_code
+
+
+# ─── MURMUR3 (used by "fractional") ───────────────────────────────────────────
+
+def _murmur3_32(data: bytes, seed: int = 0) -> int:
+    """
+    32-bit MurmurHash3 (x86 variant), same as flagd uses for fractional bucketing.
+    """
+    c1, c2 = 0xcc9e2d51, 0x1b873593
+    h = seed
+    length = len(data)
+    rounded_end = length & ~0x3
+    for i in range(0, rounded_end, 4):
+        k = int.from_bytes(data[i:i + 4], "little")
+        k = (k * c1) & 0xFFFFFFFF
+        k = ((k << 15) | (k >> 17)) & 0xFFFFFFFF
+        k = (k * c2) & 0xFFFFFFFF
+        h ^= k
+        h = ((h << 13) | (h >> 19)) & 0xFFFFFFFF
+        h = (h * 5 + 0xe6546b64) & 0xFFFFFFFF
+
+    k = 0
+    tail = length & 0x3
+    if tail == 3:
+        k ^= data[rounded_end + 2] << 16
+    if tail >= 2:
+        k ^= data[rounded_end + 1] << 8
+    if tail >= 1:
+        k ^= data[rounded_end]
+        k = (k * c1) & 0xFFFFFFFF
+        k = ((k << 15) | (k >> 17)) & 0xFFFFFFFF
+        k = (k * c2) & 0xFFFFFFFF
+        h ^= k
+
+    h ^= length
+    h ^= h >> 16
+    h = (h * 0x85ebca6b) & 0xFFFFFFFF
+    h ^= h >> 13
+    h = (h * 0xc2b2ae35) & 0xFFFFFFFF
+    h ^= h >> 16
+    return h
+
+
+# ─── JSONLOGIC COMPILER ───────────────────────────────────────────────────────
+
+def _loose_eq(a, b) -> bool:
+    if type(a) is not type(b):
+        try:
+            if isinstance(a, (int, float)) and isinstance(b, str):
+                return a == float(b)
+            if isinstance(b, (int, float)) and isinstance(a, str):
+                return float(a) == b
+        except ValueError:
+            return False
+    return a == b
+
+
+def _comparable(a, b) -> tuple | None:
+    """
+    Operands of <, <=, >, >= as JsonLogic compares them: numbers (numeric strings
+    are coerced when the other side is a number) or two strings. None when they
+    can't be compared, e.g. a missing value, which makes the comparison false as in flagd.
+    """
+    a_number = isinstance(a, (int, float)) and not isinstance(a, bool)
+    b_number = isinstance(b, (int, float)) and not isinstance(b, bool)
+    if a_number and b_number:
+        return a, b
+    if isinstance(a, str) and isinstance(b, str):
+        return a, b
+    try:
+        if a_number and isinstance(b, str):
+            return a, float(b)
+        if b_number and isinstance(a, str):
+            return float(a), b
+    except ValueError:
+        pass
+    return None
+
+
+def _less(a, b, or_equal: bool) -> bool:
+    pair = _comparable(a, b)
+    if pair is None:
+        return False
+    return pair[0] <= pair[1] if or_equal else pair[0] < pair[1]
+
+
+def _parse_semver(value) -> tuple:
+    version = str(value).lstrip("vV").split("+", 1)[0]
+    core, _, prerelease = version.partition("-")
+    parts = [int(p) for p in core.split(".")]
+    parts += [0] * (3 - len(parts))
+    # A release sorts after any of its pre-releases
+    return (parts[0], parts[1], parts[2], prerelease == "", prerelease)
+
+
+def _sem_ver(left, op, right) -> bool:
+    if op not in ("=", "!=", "<", "<=", ">", ">=", "^", "~"):
+        raise EvaluationError("PARSE_ERROR", f"unknown sem_ver operator {op!r}")
+    try:
+        a, b = _parse_semver(left), _parse_semver(right)
+    except (ValueError, IndexError):
+        # Missing or unparsable versions simply don't match, as in flagd
+        return False
+    if op == "=":
+        return a == b
+    if op == "!=":
+        return a != b
+    if op == "<":
+        return a < b
+    if op == "<=":
+        return a <= b
+    if op == ">":
+        return a > b
+    if op == ">=":
+        return a >= b
+    if op == "^":
+        return a[0] == b[0]
+    return a[0] == b[0] and a[1] == b[1]  # "~"
+
+
+def _fractional(bucket_by, distributions) -> str | None:
+    total = sum(weight for _variant, weight in distributions)
+    if not total:
+        return None
+    hash_value = _murmur3_32(str(bucket_by).encode())
+    if hash_value >= 0x80000000:
+        hash_value -= 0x100000000  # flagd works on the signed value
+    bucket = abs(hash_value) / 0x7FFFFFFF * total
+    range_end = 0
+    for variant, weight in distributions:
+        range_end += weight
+        if bucket < range_end:
+            return variant
+    return distributions[-1][0]
+
+
+def _compile_var(args):
+    path = args[0] if args else ""
+    default = args[1] if len(args) > 1 else None
+    if isinstance(path, (dict, list)):
+        raise EvaluationError("PARSE_ERROR", "dynamic var paths are not supported")
+    if path == "" or path is None:
+        return lambda data: data
+    parts = str(path).split(".")
+
+    def var(data):
+        value = data
+        for part in parts:
+            if isinstance(value, dict):
+                if part not in value:
+                    return default
+                value = value[part]
+            elif isinstance(value, list):
+                try:
+                    value = value[int(part)]
+                except (ValueError, IndexError):
+                    return default
+            else:
+                return default
+        return value
+    return var
+
+
+def _compile(rule):
+    """
+    Compile a JsonLogic rule into a function of the evaluation context.
+    """
+    if isinstance(rule, list):
+        items = [_compile(r) for r in rule]
+        return lambda data: [item(data) for item in items]
+    if not isinstance(rule, dict) or len(rule) != 1:
+        return lambda data: rule
+
+    op, raw_args = next(iter(rule.items()))
+    if not isinstance(raw_args, list):
+        raw_args = [raw_args]
+
+    if op == "var":
+        return _compile_var(raw_args)
+
+    if op == "fractional":
+        # Optional first argument is the bucketing expression; it defaults to
+        # flagKey + targetingKey like in flagd.
+        if raw_args and not isinstance(raw_args[0], list):
+            bucket_by = _compile(raw_args[0])
+            buckets = raw_args[1:]
+        else:
+            flag_key = _compile_var(["$flagd.flagKey"])
+            targeting_key = _compile_var(["targetingKey", ""])
+            bucket_by = lambda data: f"{flag_key(data)}{targeting_key(data)}"
+            buckets = raw_args
+        distributions = [(_compile(b[0]), b[1] if len(b) > 1 else 1) for b in buckets]
+        return lambda data: _fractional(
+            bucket_by(data), [(variant(data), weight) for variant, weight in distributions]
+        )
+
+    args = [_compile(a) for a in raw_args]
+
+    if op == "if":
+        def if_(data):
+            for i in range(0, len(args) - 1, 2):
+                if args[i](data):
+                    return args[i + 1](data)
+            return args[-1](data) if len(args) % 2 else None
+        return if_
+    if op == "and":
+        def and_(data):
+            value = None
+            for arg in args:
+                value = arg(data)
+                if not value:
+                    return value
+            return value
+        return and_
+    if op == "or":
+        def or_(data):
+            value = None
+            for arg in args:
+                value = arg(data)
+                if value:
+                    return value
+            return value
+        return or_
+    if op == "!":
+        return lambda data: not args[0](data)
+    if op == "!!":
+        return lambda data: bool(args[0](data))
+    if op == "==":
+        return lambda data: _loose_eq(args[0](data), args[1](data))
+    if op == "!=":
+        return lambda data: not _loose_eq(args[0](data), args[1](data))
+    if op == "===":
+        return lambda data: args[0](data) == args[1](data)
+    if op == "!==":
+        return lambda data: args[0](data) != args[1](data)
+    if op in ("<", "<="):
+        or_equal = op == "<="
+        if len(args) == 3:
+            def between(data):
+                middle = args[1](data)
+                return _less(args[0](data), middle, or_equal) and _less(middle, args[2](data), or_equal)
+            return between
+        return lambda data: _less(args[0](data), args[1](data), or_equal)
+    if op in (">", ">="):
+        or_equal = op == ">="
+        return lambda data: _less(args[1](data), args[0](data), or_equal)
+    if op == "in":
+        def in_(data):
+            needle, haystack = args[0](data), args[1](data)
+            if isinstance(haystack, str):
+                return str(needle) in haystack
+            return needle in (haystack or [])
+        return in_
+    if op == "cat":
+        return lambda data: "".join(str(arg(data)) for arg in args)
+    if op == "starts_with":
+        return lambda data: str(args[0](data)).startswith(str(args[1](data)))
+    if op == "ends_with":
+        return lambda data: str(args[0](data)).endswith(str(args[1](data)))
+    if op == "sem_ver":
+        return lambda data: _sem_ver(args[0](data), args[1](data), args[2](data))
+
+    raise EvaluationError("PARSE_ERROR", f"unsupported targeting operator {op!r}")
+
+
+# ─── COMPILED FLAGS ───────────────────────────────────────────────────────────
+
+class CompiledFlag:
+    """
+    One flag definition, ready to evaluate. Everything that doesn't depend on the
+    context (state, default variant/value, compiled targeting) is resolved up front.
+    """
+    __slots__ = ("key", "variants", "default_variant", "disabled", "targeting", "error")
+
+    def __init__(self, key: str, definition: dict):
+        self.key = key
+        self.variants = definition.get("variants") or {}
+        self.default_variant = definition.get("defaultVariant")
+        self.disabled = definition.get("state") == "DISABLED"
+        self.targeting = None
+        self.error = None
+        if self.default_variant not in self.variants:
+            self.error = EvaluationError("PARSE_ERROR", f"defaultVariant {self.default_variant!r} is not a variant")
+        targeting = definition.get("targeting")
+        if targeting:
+            try:
+                self.targeting = _compile(targeting)
+            except EvaluationError as e:
+                self.error = e
+
+    def _resolved(self, variant: str, reason: str) -> dict:
+        return {"value": self.variants[variant], "variant": variant, "reason": reason}
+
+    def evaluate(self, context: dict) -> dict:
+        if self.disabled:
+            return {"value": None, "variant": None, "reason": "DISABLED", "errorCode": "FLAG_DISABLED"}
+        if self.error is not None:
+            return _error(self.error.error_code, str(self.error))
+        if self.targeting is None:
+            return self._resolved(self.default_variant, "STATIC")
+
+        data = dict(context)
+        data["$flagd"] = {"flagKey": self.key, "timestamp": int(time.time())}
+        try:
+            variant = self.targeting(data)
+        except EvaluationError as e:
+            return _error(e.error_code, str(e))
+        except Exception as e:
+            return _error("GENERAL", f"targeting failed: {e}")
+
+        if variant is None or variant == "":
+            return self._resolved(self.default_variant, "DEFAULT")
+        if isinstance(variant, bool):
+            variant = "true" if variant else "false"
+        if not isinstance(variant, str):
+            return _error("TYPE_MISMATCH", f"targeting returned {type(variant).__name__}, expected a variant name")
+        if variant not in self.variants:
+            return _error("GENERAL", f"targeting returned unknown variant {variant!r}")
+        return self._resolved(variant, "TARGETING_MATCH")
+
+
+def _error(error_code: str, message: str) -> dict:
+    return {"value": None, "variant": None, "reason": "ERROR", "errorCode": error_code, "errorMessage": message}
+
+
+# env -> (flags dict the compilation was built from, {flagKey: CompiledFlag})
+# k8s_utils.read_flags() returns the same dict object while its cache entry is
+# fresh, so an identity check is enough to know when to recompile.
+_compiled: dict[str, tuple[dict, dict[str, CompiledFlag]]] = {}
+_compiled_mutex = threading.Lock()
+
+
+def compile_flags(flags: dict[str, dict]) -> dict[str, CompiledFlag]:
+    return {key: CompiledFlag(key, definition or {}) for key, definition in flags.items()}
+
+
+def _get_compiled(project: str, env: str) -> dict[str, CompiledFlag]:
+    """
+    Compiled flags of env's FeatureFlag CR in the default cluster. Raises when the CR can't be read.
+    """
+    flags = k8s_utils.read_flags(env)
+    with _compiled_mutex:
+        entry = _compiled.get(env)
+        if entry is not None and entry[0] is flags:
+            return entry[1]
+    compiled = compile_flags(flags)
+    with _compiled_mutex:
+        _compiled[env] = (flags, compiled)
+    return compiled
+
+
+def evaluate_batch(project: str, evaluations: list[tuple[str, str, dict]]) -> list[dict]:
+    """
+    Resolve a batch of (env, flagKey, context) against the live FeatureFlag CRs
+    of project's envs (as listed in the flags repo).
+    Each env's flags are fetched and compiled once per batch (and reused across
+    batches until the CR changes). Results come back in request order; when an
+    env's CR can't be read, its items fail with GENERAL rather than FLAG_NOT_FOUND.
+    """
+    # env -> (compiled flags, None) or (None, error message)
+    envs: dict[str, tuple[dict[str, CompiledFlag] | None, str | None]] = {}
+    project_envs = set(git_utils.get_all_envs(project, git_utils.FLAG_PAT) or [])
+    results = []
+    for env, flag_key, context in evaluations:
+        if env not in envs and env not in project_envs:
+            envs[env] = (None, f"env {env!r} is not part of project {project!r}")
+        elif env not in envs:
+            try:
+                envs[env] = (_get_compiled(project, env), None)
+            except Exception as e:
+                print(f"K8s get error: {e}")
+                envs[env] = (None, f"could not read flags for {env}: {e}")
+        compiled, env_error = envs[env]
+
+        flag = compiled.get(flag_key) if compiled is not None else None
+        if env_error is not None:
+            result = _error("GENERAL", env_error)
+        elif flag is None:
+            result = _error("FLAG_NOT_FOUND", f"flag {flag_key!r} not found in {env}")
+        else:
+            result = flag.evaluate(context or {})
+        result["env"] = env
+        result["flagKey"] = flag_key
+        results.append(result)
+    return results
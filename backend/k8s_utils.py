@@ -1,90 +1,507 @@
-from kubernetes import client, config
-import jsonpatch
+import contextvars
+import copy
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, Protocol
+import yaml
 from dotenv import load_dotenv
+import cache
+import audit
+import tracing
 
-# Automatically detect the environment
 load_dotenv()
-if os.getenv("KUBERNETES_SERVICE_HOST"):
-    config.load_incluster_config()
-else:
-    config.load_kube_config()
 
-from kubernetes import client, config
-import os
+# FeatureFlag CRs managed by the OpenFeature Operator
+GROUP = "core.openfeature.dev"
+VERSION = "v1beta1"
+PLURAL = "featureflags"
 
-def get_flags(project, env):
-    try:
-        # Use in-cluster config if running in a Pod
-        if os.getenv("KUBERNETES_SERVICE_HOST"):
-            config.load_incluster_config()
-        else:
-            config.load_kube_config()
+# "kubernetes" (default) talks to a real cluster; "fake" keeps FeatureFlag CRs in memory,
+# optionally seeded from K8S_FAKE_FILE (a multi-document YAML of FeatureFlag objects).
+K8S_BACKEND = os.environ.get("K8S_BACKEND", "kubernetes")
+K8S_FAKE_FILE = os.environ.get("K8S_FAKE_FILE")
+# Clusters to talk to, as comma-separated kubeconfig context names (e.g. "mum-dev,mum-prod").
+# The first one is the default cluster. Unset means a single cluster named "default"
+# using the in-cluster config or the kubeconfig's current context.
+K8S_CONTEXTS = [c.strip() for c in os.environ.get("K8S_CONTEXTS", "").split(",") if c.strip()]
+CLUSTERS = K8S_CONTEXTS or ["default"]
+DEFAULT_CLUSTER = CLUSTERS[0]
+
+
+def _namespace(env: str) -> str:
+    return f"flagd-{env}"
+
+
+def _name(env: str) -> str:
+    return f"{env}-app-flags"
+
+
+# ─── BACKENDS ─────────────────────────────────────────────────────────────────
+
+class FeatureFlagBackend(Protocol):
+    """
+    The calls we need from the cluster. get/patch return the full FeatureFlag object
+    and raise on failure (including not found); list returns every FeatureFlag in
+    every namespace as `{"items": [...], "metadata": {"resourceVersion": ...}}`;
+    watch yields (event type, object) for changes after resource_version until
+    timeout_seconds, and raises when resource_version is too old to resume from.
+    """
+    def get_feature_flag(self, namespace: str, name: str) -> dict: ...
+
+    def patch_feature_flag(self, namespace: str, name: str, body: dict) -> dict: ...
+
+    def list_feature_flags(self) -> dict: ...
 
-        api = client.CustomObjectsApi()
+    def watch_feature_flags(self, timeout_seconds: int, resource_version: str) -> Iterator[tuple[str, dict]]: ...
 
-        # ✅ Correct group, version, and plural
-        group = "core.openfeature.dev"
-        version = "v1beta1"
-        namespace = f"flagd-{env}"
-        plural = "featureflags"
-        name = f"{env}-app-flags"
 
-        flags_source = api.get_namespaced_custom_object(
-            group=group,
-            version=version,
+class KubernetesBackend:
+    """
+    Real cluster access. The kubernetes package is only imported (and the config
+    only loaded) when this backend is first created, i.e. on the first k8s call.
+    Each backend has its own ApiClient, so several clusters can be used side by side.
+
+    :param context: kubeconfig context name, or None for the in-cluster config
+                    (when running in a Pod) / the kubeconfig's current context.
+    """
+    def __init__(self, context: str | None = None):
+        from kubernetes import client, config
+
+        # Use in-cluster config if running in a Pod
+        if context is None and os.getenv("KUBERNETES_SERVICE_HOST"):
+            configuration = client.Configuration()
+            config.load_incluster_config(client_configuration=configuration)
+            api_client = client.ApiClient(configuration)
+        else:
+            api_client = config.new_client_from_config(context=context)
+        self._api = client.CustomObjectsApi(api_client)
+
+    def get_feature_flag(self, namespace: str, name: str) -> dict:
+        return self._api.get_namespaced_custom_object(
+            group=GROUP,
+            version=VERSION,
             namespace=namespace,
-            plural=plural,
+            plural=PLURAL,
             name=name
         )
 
-        # ✅ Path to flags is now under `spec.flagSpec.flags`
-        flags = flags_source.get("spec", {}).get("flagSpec", {}).get("flags", {})
-        return flags
+    def patch_feature_flag(self, namespace: str, name: str, body: dict) -> dict:
+        return self._api.patch_namespaced_custom_object(
+            group=GROUP,
+            version=VERSION,
+            namespace=namespace,
+            plural=PLURAL,
+            name=name,
+            body=body,
+        )
+
+    def list_feature_flags(self) -> dict:
+        return self._api.list_cluster_custom_object(
+            group=GROUP,
+            version=VERSION,
+            plural=PLURAL,
+        )
+
+    def watch_feature_flags(self, timeout_seconds: int, resource_version: str) -> Iterator[tuple[str, dict]]:
+        from kubernetes import watch
+
+        # An expired resource_version comes back as an ERROR event, which the
+        # client raises as ApiException(410)
+        stream = watch.Watch().stream(
+            self._api.list_cluster_custom_object,
+            group=GROUP,
+            version=VERSION,
+            plural=PLURAL,
+            resource_version=resource_version,
+            timeout_seconds=timeout_seconds,
+        )
+        for event in stream:
+            yield event["type"], event["object"]
+
+
+def merge_patch(target: dict, patch: dict) -> dict:
+    """
+    JSON merge patch (RFC 7386), which is what the API server applies to custom objects.
+    """
+    result = copy.deepcopy(target)
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        elif isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = merge_patch(result[key], value)
+        else:
+            result[key] = copy.deepcopy(value)
+    return result
+
+
+class FakeBackend:
+    """
+    In-memory FeatureFlag store for local runs and tests without a cluster.
+    Objects are keyed by (namespace, name); resourceVersion is bumped on every change,
+    and every change is kept as a watch event.
+    """
+    def __init__(self, objects: list[dict] | None = None):
+        self._objects: dict[tuple[str, str], dict] = {}
+        self._events: list[tuple[int, str, dict]] = []
+        self._lock = threading.Condition()
+        self._resource_version = 0
+        for obj in objects or []:
+            self.add(obj)
+
+    @classmethod
+    def from_file(cls, path: str) -> "FakeBackend":
+        with open(path) as f:
+            return cls([doc for doc in yaml.safe_load_all(f) if doc])
+
+    def add(self, obj: dict) -> None:
+        obj = copy.deepcopy(obj)
+        metadata = obj.setdefault("metadata", {})
+        with self._lock:
+            key = (metadata.get("namespace"), metadata.get("name"))
+            self._changed("MODIFIED" if key in self._objects else "ADDED", obj)
+            self._objects[key] = obj
+
+    def delete(self, namespace: str, name: str) -> None:
+        with self._lock:
+            obj = self._objects.pop((namespace, name), None)
+            if obj is not None:
+                self._changed("DELETED", copy.deepcopy(obj))
+
+    def _changed(self, event_type: str, obj: dict) -> None:
+        # Caller holds _lock
+        self._resource_version += 1
+        obj["metadata"]["resourceVersion"] = str(self._resource_version)
+        self._events.append((self._resource_version, event_type, copy.deepcopy(obj)))
+        self._lock.notify_all()
+
+    def get_feature_flag(self, namespace: str, name: str) -> dict:
+        with self._lock:
+            obj = self._objects.get((namespace, name))
+            if obj is None:
+                raise KeyError(f"featureflags {namespace}/{name} not found")
+            return copy.deepcopy(obj)
+
+    def patch_feature_flag(self, namespace: str, name: str, body: dict) -> dict:
+        with self._lock:
+            obj = self._objects.get((namespace, name))
+            if obj is None:
+                raise KeyError(f"featureflags {namespace}/{name} not found")
+            obj = merge_patch(obj, body)
+            self._changed("MODIFIED", obj)
+            self._objects[(namespace, name)] = obj
+            return copy.deepcopy(obj)
+
+    def list_feature_flags(self) -> dict:
+        with self._lock:
+            return {
+                "items": [copy.deepcopy(obj) for obj in self._objects.values()],
+                "metadata": {"resourceVersion": str(self._resource_version)},
+            }
+
+    def watch_feature_flags(self, timeout_seconds: int, resource_version: str) -> Iterator[tuple[str, dict]]:
+        deadline = time.monotonic() + timeout_seconds
+        last = int(resource_version)
+        while True:
+            with self._lock:
+                self._lock.wait_for(lambda: self._resource_version > last,
+                                    timeout=max(0.0, deadline - time.monotonic()))
+                events = [(rv, event_type, obj) for rv, event_type, obj in self._events if rv > last]
+            if not events:
+                return
+            for rv, event_type, obj in events:
+                last = rv
+                yield event_type, copy.deepcopy(obj)
+
+
+_backends: dict[str, FeatureFlagBackend] = {}
+_backend_mutex = threading.Lock()
+# Called once, when the default cluster's backend is first created (see on_first_use).
+_first_use_callbacks: list = []
+_used = False
+
+# Runs per-cluster calls concurrently so a fan-out takes as long as the slowest cluster.
+_cluster_pool = ThreadPoolExecutor(max_workers=max(4, 2 * len(CLUSTERS)), thread_name_prefix="k8s")
+
+
+def get_backend(cluster: str | None = None) -> FeatureFlagBackend:
+    """
+    Create the backend for cluster (default: DEFAULT_CLUSTER) on first use. If the
+    kubeconfig can't be loaded this raises, and the next call tries again; nothing
+    happens at import time.
+    """
+    global _used
+    cluster = cluster or DEFAULT_CLUSTER
+    if cluster not in CLUSTERS:
+        raise KeyError(f"unknown cluster {cluster!r}")
+    callbacks = []
+    with _backend_mutex:
+        backend = _backends.get(cluster)
+        if backend is None:
+            if K8S_BACKEND == "fake":
+                backend = FakeBackend.from_file(K8S_FAKE_FILE) if K8S_FAKE_FILE else FakeBackend()
+            else:
+                backend = KubernetesBackend(cluster if K8S_CONTEXTS else None)
+            _backends[cluster] = backend
+        if cluster == DEFAULT_CLUSTER and not _used:
+            _used = True
+            callbacks = list(_first_use_callbacks)
+    for callback in callbacks:
+        callback()
+    return backend
+
+
+def on_first_use(callback) -> None:
+    """
+    Run callback once the default cluster is first used (right away if it already was),
+    so work that needs the cluster doesn't load the Kubernetes client at startup.
+    """
+    with _backend_mutex:
+        if not _used:
+            _first_use_callbacks.append(callback)
+            return
+    callback()
+
+
+def set_backend(backend: FeatureFlagBackend | None, cluster: str | None = None) -> None:
+    """
+    Replace a cluster's backend (e.g. with a FakeBackend in tests). None resets to lazy init.
+    """
+    cluster = cluster or DEFAULT_CLUSTER
+    with _backend_mutex:
+        if backend is None:
+            _backends.pop(cluster, None)
+        else:
+            _backends[cluster] = backend
+
+
+def _run_on_clusters(fn, clusters: list[str]) -> dict[str, tuple[object, Exception | None]]:
+    """
+    Call fn(cluster) for every cluster concurrently.
+    Returns {cluster: (result, None)} or {cluster: (None, error)} per cluster.
+    """
+    # copy_context() so spans recorded on pool threads land in the caller's trace
+    futures = {
+        cluster: _cluster_pool.submit(contextvars.copy_context().run, fn, cluster)
+        for cluster in clusters
+    }
+    results = {}
+    for cluster, future in futures.items():
+        try:
+            results[cluster] = (future.result(), None)
+        except Exception as e:
+            results[cluster] = (None, e)
+    return results
+
+
+# ─── PUBLIC FUNCTIONS ─────────────────────────────────────────────────────────
+
+def _read_flags(cluster: str, env: str) -> dict:
+    """
+    Flags of env's FeatureFlag CR in cluster (cached by resourceVersion). Raises on failure.
+    """
+    key = ("cr", cluster, env)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    with tracing.span("k8s get", cluster=cluster, env=env):
+        flags_source = get_backend(cluster).get_feature_flag(_namespace(env), _name(env))
 
+    # ✅ Path to flags is now under `spec.flagSpec.flags`
+    flags = flags_source.get("spec", {}).get("flagSpec", {}).get("flags", {})
+    cache.put(key, flags, flags_source.get("metadata", {}).get("resourceVersion"))
+    return flags
+
+
+def read_flags(env: str, cluster: str | None = None) -> dict:
+    """
+    Flags of env's FeatureFlag CR (default cluster unless given). Unlike get_flags,
+    raises when the CR can't be read, so callers can tell that apart from a missing flag.
+    """
+    return _read_flags(cluster or DEFAULT_CLUSTER, env)
+
+
+def get_flags(project, env, cluster: str | None = None):
+    try:
+        return _read_flags(cluster or DEFAULT_CLUSTER, env)
     except Exception as e:
         print(f"K8s get error: {e}")
         return None
 
-from kubernetes import client, config
-from typing import Dict
 
-def patch_flags(project: str, env: str, flags: Dict[str, dict]) -> bool:
+def get_flags_all(project: str, env: str, clusters: list[str] | None = None) -> dict:
+    """
+    Read env's flags from several clusters (default: all) concurrently and merge them:
+    `{
+        "clusters": {"mum-dev": {"ok": true}, "mum-prod": {"ok": false, "error": "..."}},
+        "flags": {
+            "fib-algo": {
+                "consistent": false,
+                "clusters": {"mum-dev": {...definition...}, "mum-prod": {...definition...}}
+            }
+        }
+    }`
+    A flag is consistent when every cluster that answered has the same definition.
+    """
+    clusters = clusters or CLUSTERS
+    results = _run_on_clusters(lambda cluster: _read_flags(cluster, env), clusters)
+
+    status = {}
+    merged: dict[str, dict] = {}
+    for cluster, (flags, error) in results.items():
+        if error is not None:
+            print(f"K8s get error on {cluster}: {error}")
+            status[cluster] = {"ok": False, "error": str(error)}
+            continue
+        status[cluster] = {"ok": True}
+        for flag, definition in flags.items():
+            merged.setdefault(flag, {"clusters": {}})["clusters"][cluster] = definition
+
+    answered = sum(1 for s in status.values() if s["ok"])
+    for entry in merged.values():
+        definitions = list(entry["clusters"].values())
+        entry["consistent"] = len(definitions) == answered and all(d == definitions[0] for d in definitions)
+    return {"clusters": status, "flags": merged}
+
+
+def patch_flags(project: str, env: str, flags: Dict[str, dict], username: str = "Unknown User",
+                clusters: list[str] | None = None) -> dict[str, str | None]:
     """
-    Patch a FeatureFlag custom resource in Kubernetes managed by OpenFeature Operator.
+    Patch a FeatureFlag custom resource in Kubernetes managed by OpenFeature Operator,
+    in every chosen cluster at once.
 
     :param project: Project name (currently unused, included for future logic).
     :param env: The environment name, which is also the namespace (e.g., 'review-mr-23').
     :param flags: A dictionary of flags to patch into the resource.
-    :return: True if successful, False otherwise.
+    :param username: GitLab username recorded in the audit log.
+    :param clusters: Clusters to patch (default: DEFAULT_CLUSTER only).
+    :return: {cluster: None} for each cluster patched, {cluster: "error"} for each that failed.
     """
-    try:
-        api = client.CustomObjectsApi()
-
-        group = "core.openfeature.dev"
-        version = "v1beta1"
-        plural = "featureflags"
-        namespace = f"flagd-{env}"
-        name = f"{env}-app-flags"
-
-        patch_body = {
-            "spec": {
-                "flagSpec": {
-                    "flags": flags
-                }
+    namespace = _namespace(env)
+    clusters = clusters or [DEFAULT_CLUSTER]
+    patch_body = {
+        "spec": {
+            "flagSpec": {
+                "flags": flags
             }
         }
+    }
 
-        print(api.patch_namespaced_custom_object(
-            group=group,
-            version=version,
-            namespace=namespace,
-            plural=plural,
-            name=name,
-            body=patch_body,
-        ))
-        return True
+    def patch(cluster: str) -> dict:
+        backend = get_backend(cluster)
+        with tracing.span("k8s get", cluster=cluster, env=env):
+            current = backend.get_feature_flag(namespace, _name(env))
+        before = current.get("spec", {}).get("flagSpec", {}).get("flags") or {}
+        with tracing.span("k8s patch", cluster=cluster, env=env):
+            print(backend.patch_feature_flag(namespace, _name(env), patch_body))
+        cache.invalidate(("cr", cluster, env))
+        return before
 
-    except Exception as e:
-        print(f"[ERROR] Failed to patch FeatureFlag in namespace '{namespace}': {e}")
-        return False
+    outcome = {}
+    for cluster, (before, error) in _run_on_clusters(patch, clusters).items():
+        if error is not None:
+            print(f"[ERROR] Failed to patch FeatureFlag in namespace '{namespace}' on {cluster}: {error}")
+            outcome[cluster] = str(error)
+            continue
+        outcome[cluster] = None
+        audit.record(username, project, env, "live-patch",
+                     [(flag, before.get(flag), value) for flag, value in flags.items()], cluster=cluster)
+    return outcome
+
+
+# Where the FeatureFlag watch on the default cluster left off, and the envs it
+# has reported as existing (so a re-list can report the ones deleted meanwhile).
+_watch_resource_version: str | None = None
+_watched_envs: set[str] = set()
+
+
+def _flag_event(event_type: str, obj: dict) -> tuple[str, str, dict] | None:
+    """
+    Apply one FeatureFlag event to the CR cache; (event type, env, flags) or None to skip it.
+    """
+    suffix = _name("")
+    metadata = obj.get("metadata", {})
+    name = metadata.get("name", "")
+    if not name.endswith(suffix):
+        return None
+    env = name[:-len(suffix)]
+    flags = obj.get("spec", {}).get("flagSpec", {}).get("flags", {})
+
+    key = ("cr", DEFAULT_CLUSTER, env)
+    if event_type == "DELETED":
+        cache.invalidate(key)
+        _watched_envs.discard(env)
+    elif event_type in ("ADDED", "MODIFIED"):
+        if cache.get_version(key) != metadata.get("resourceVersion"):
+            cache.put(key, flags, metadata.get("resourceVersion"))
+        _watched_envs.add(env)
+    else:
+        return None
+    return event_type, env, flags
+
+
+def watch_synced() -> bool:
+    """
+    True once watch_flags has listed every CR, i.e. the cluster side is fully known.
+    """
+    return _watch_resource_version is not None
+
+
+def watch_flags(timeout_seconds: int = 300) -> Iterator[tuple[str, str, dict]]:
+    """
+    Follow every FeatureFlag CR in the default cluster and yield (event type, env, flags)
+    as they change. The first call lists every CR (one ADDED event each); later calls
+    resume the watch where the previous one ended, so no event is missed between them.
+    If the watch can't resume (resourceVersion expired, or any watch error), the next
+    call lists again and yields DELETED for CRs that went away in the meantime.
+    Each call ends after timeout_seconds; callers loop to continue. The CR cache is
+    kept up to date from the events as a side effect.
+    """
+    global _watch_resource_version
+    backend = get_backend()
+    if _watch_resource_version is None:
+        listing = backend.list_feature_flags()
+        listed = set()
+        for obj in listing.get("items", []):
+            event = _flag_event("ADDED", obj)
+            if event is not None:
+                listed.add(event[1])
+                yield event
+        for env in sorted(_watched_envs - listed):
+            yield _flag_event("DELETED", {"metadata": {"name": _name(env)}})
+        _watch_resource_version = listing.get("metadata", {}).get("resourceVersion")
+
+    try:
+        for event_type, obj in backend.watch_feature_flags(timeout_seconds, _watch_resource_version):
+            _watch_resource_version = obj.get("metadata", {}).get("resourceVersion") or _watch_resource_version
+            event = _flag_event(event_type, obj)
+            if event is not None:
+                yield event
+    except Exception:
+        _watch_resource_version = None
+        raise
+
+
+def revalidate_cache() -> None:
+    """
+    Re-read every cached FeatureFlag CR, e.g. after a warm start from a snapshot.
+    Custom objects have no conditional GET, so each CR is fetched again; the
+    entry is only replaced when its resourceVersion moved on.
+    """
+    for key in cache.keys("cr"):
+        _, cluster, env = key
+        try:
+            flags_source = get_backend(cluster).get_feature_flag(_namespace(env), _name(env))
+        except Exception as e:
+            print(f"K8s revalidate error for {env} on {cluster}: {e}")
+            cache.invalidate(key)
+            continue
+
+        resource_version = flags_source.get("metadata", {}).get("resourceVersion")
+        if resource_version == cache.get_version(key):
+            cache.touch(key)
+        else:
+            flags = flags_source.get("spec", {}).get("flagSpec", {}).get("flags", {})
+            cache.put(key, flags, resource_version)
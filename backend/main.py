@@ -1,20 +1,50 @@
 from dotenv import load_dotenv
-from fastapi import Query, FastAPI, HTTPException, Request, Body
+from fastapi import Query, FastAPI, HTTPException, Request, Body, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import RedirectResponse, PlainTextResponse
 from pydantic import RootModel, BaseModel
-from typing import Dict, List
+from typing import Any, Dict, List
+from datetime import datetime
+from contextlib import asynccontextmanager
 import git_utils
 import k8s_utils
+import evaluator
+import search_index
+import audit
+import drift
+import change_feed
+import metrics
+import rate_limit
+import tracing
+import snapshot
 import requests
 import os
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Fail fast if the audit log can't be opened rather than silently dropping entries
+    audit.init()
+    # Warm the caches from the on-disk snapshot (in the background) and keep it updated
+    snapshot.start()
+    # Build the cross-project flag search index and the drift report, both kept
+    # current from one feed of Git commits and FeatureFlag watch events
+    search_index.start()
+    drift.start()
+    change_feed.start()
+    yield
+    change_feed.stop()
+    snapshot.stop()
+
+# Every route is charged against a per-user, per-route token bucket (429 + Retry-After when empty)
+app = FastAPI(lifespan=lifespan, dependencies=[Depends(rate_limit.check_rate_limit)])
 load_dotenv()
 # Secrets from env
 CLIENT_ID = os.getenv("CLIENT_ID")
 CLIENT_SECRET = os.getenv("CLIENT_SECRET")
 REDIRECT_URI = os.getenv("REDIRECT_URI", "https://featureflags-ui.bharathrajiv.org")
+# GitLab usernames allowed to trace requests and read /debug/traces
+ADMIN_USERS = {u.strip() for u in os.getenv("ADMIN_USERS", "").split(",") if u.strip()}
 # Enable CORS, allowing exactly REDIRECT_URI as the origin
 app.add_middleware(
     CORSMiddleware,
@@ -68,6 +98,23 @@ class FlagUpdateRequest(RootModel[Dict[str, dict]]):
     """
     pass
 
+class FlagEvaluation(BaseModel):
+    env: str
+    flagKey: str
+    context: Dict[str, Any] = {}
+
+class EvaluationRequest(BaseModel):
+    """
+    Expect a JSON body like:
+    `{
+        "evaluations": [
+            {"env": "expense-manager-backend-beta", "flagKey": "fib-algo", "context": {"targetingKey": "user-1"}},
+            {"env": "expense-manager-backend-ci", "flagKey": "use-remote-fib-service"}
+        ]
+    }`
+    """
+    evaluations: List[FlagEvaluation]
+
 class OAuthCallbackRequest(BaseModel):
     code: str
     codeVerifier: str
@@ -79,12 +126,34 @@ def get_token_from_cookie(request: Request) -> str:
         raise HTTPException(status_code=401, detail="Missing access token")
     return token
 
+def is_admin(token: str | None) -> bool:
+    if not token or not ADMIN_USERS:
+        return False
+    return rate_limit.username_for_token(token) in ADMIN_USERS
+
+def require_admin(request: Request) -> None:
+    if not is_admin(get_token_from_cookie(request)):
+        raise HTTPException(status_code=403, detail="Admins only")
+
+async def authorize_trace(scope) -> bool:
+    return await run_in_threadpool(is_admin, Request(scope).cookies.get("access_token"))
+
+# Opt-in request tracing: send `X-Debug-Trace: 1|inline|profile` (or ?debug_trace=...) as an admin
+app.add_middleware(tracing.TraceMiddleware, authorize=authorize_trace)
+
 # ----------------- ROUTES ------------------
 
 @app.get("/")
 def root():
     return {"status": "ok"}
 
+# Readiness probe: only ready once the cache snapshot has been loaded
+@app.get("/ready")
+def ready():
+    if not snapshot.is_ready():
+        raise HTTPException(status_code=503, detail="Warm start in progress")
+    return {"status": "ready"}
+
 # OAuth2 PKCE callback
 @app.post("/oauth/callback")
 def oauth_callback(request: OAuthCallbackRequest = Body(...)):
@@ -97,7 +166,8 @@ def oauth_callback(request: OAuthCallbackRequest = Body(...)):
         "redirect_uri": request.redirect_uri,
         "code_verifier": request.codeVerifier,
     }
-    response = requests.post(token_url, data=data)
+    with rate_limit.gitlab.slot():
+        response = requests.post(token_url, data=data)
     if response.status_code != 200:
         raise HTTPException(status_code=500, detail=response.text)
 
@@ -130,7 +200,8 @@ def userinfo(request: Request) -> Dict:
     pat = get_token_from_cookie(request)
     url = "https://gitlab.com/api/v4/user" 
     headers = {"Authorization": f"Bearer {pat}"}
-    response = requests.get(url, headers=headers)
+    with rate_limit.gitlab.slot():
+        response = requests.get(url, headers=headers)
     if response.status_code != 200:
         raise HTTPException(status_code=response.status_code, detail="Failed to fetch user info")
     user_data = response.json()
@@ -149,9 +220,29 @@ def list_envs(project: str, request: Request):
         raise HTTPException(status_code=404, detail="Project not found")
     return envs
 
+def parse_clusters(clusters: str | None) -> List[str] | None:
+    if not clusters:
+        return None
+    if clusters == "all":
+        return list(k8s_utils.CLUSTERS)
+    names = [c.strip() for c in clusters.split(",") if c.strip()]
+    unknown = [c for c in names if c not in k8s_utils.CLUSTERS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown clusters: {', '.join(unknown)}")
+    return names
+
 @app.get("/flags/{project}/{env}", response_model=Dict[str, dict])
-def get_flags(project: str, env: str, request: Request):
+def get_flags(
+    project: str,
+    env: str,
+    request: Request,
+    clusters: str | None = Query(None, description="Comma-separated cluster names, or 'all'. "
+                                                   "Returns a merged, per-cluster result.")
+):
     get_token_from_cookie(request)  # Auth check (token not needed by k8s)
+    cluster_names = parse_clusters(clusters)
+    if cluster_names:
+        return k8s_utils.get_flags_all(project, env, cluster_names)
     try:
         flags_dict = k8s_utils.get_flags(project, env)
     except Exception as e:
@@ -180,6 +271,34 @@ def update_flags(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.patch("/flags/{project}/{env}")
+def live_patch_flags(
+    project: str,
+    env: str,
+    request_body: FlagUpdateRequest,
+    request: Request,
+    clusters: str | None = Query(None, description="Comma-separated cluster names, or 'all' (default: default cluster)")
+):
+    pat = get_token_from_cookie(request)
+    # Only preview envs are patched live; everything else goes through Git (PUT)
+    if not env.startswith("review-mr-"):
+        raise HTTPException(status_code=400, detail="Live patching is only allowed for review-mr-* envs")
+    username = rate_limit.username_for_token(pat)
+    if username is None:
+        raise HTTPException(status_code=401, detail="Could not verify access token")
+    # Same rules as /projects/{project}/envs: the env must be one of the project's and visible to the caller
+    envs = git_utils.get_all_envs(project, git_utils.FLAG_PAT)
+    if envs is None or env not in envs:
+        raise HTTPException(status_code=404, detail=f"{env} is not an env of {project}")
+    if not git_utils.get_access(pat).can_see(project, env):
+        raise HTTPException(status_code=403, detail=f"No access to {project}/{env}")
+    updates: Dict[str, dict] = request_body.model_dump()
+    outcome = k8s_utils.patch_flags(project, env, updates, username, parse_clusters(clusters))
+    failed = {cluster: error for cluster, error in outcome.items() if error}
+    if len(failed) == len(outcome):
+        raise HTTPException(status_code=500, detail={"status": "failed", "clusters": outcome})
+    return {"status": "partial" if failed else "patched", "clusters": outcome}
+
 @app.post("/flags/{project}")
 def add_flag(
     project: str,
@@ -198,3 +317,89 @@ def add_flag(
         raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/evaluate/{project}")
+def evaluate_flags(
+    project: str,
+    request_body: EvaluationRequest,
+    request: Request
+):
+    get_token_from_cookie(request)  # Auth check (token not needed by k8s)
+    evaluations = [(e.env, e.flagKey, e.context) for e in request_body.evaluations]
+    return {"results": evaluator.evaluate_batch(project, evaluations)}
+
+@app.get("/search/flags")
+def search_flags(
+    request: Request,
+    q: str | None = Query(None, description="Flag name to look for"),
+    match: str = Query("substring", pattern="^(prefix|substring)$"),
+    state: str | None = Query(None, description="ENABLED or DISABLED"),
+    variant: str | None = Query(None, description="Variant key, e.g. on"),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    pat = get_token_from_cookie(request)
+    # The index is built with FLAG_PAT, so only show what /projects and /projects/{p}/envs would
+    visible = git_utils.get_access(pat).can_see
+    return {
+        "ready": search_index.is_ready(),
+        "results": search_index.search(q=q, state=state, variant=variant, match=match, limit=limit,
+                                       visible=visible),
+    }
+
+@app.get("/audit")
+def get_audit_log(
+    request: Request,
+    flag: str | None = None,
+    project: str | None = None,
+    env: str | None = None,
+    user: str | None = None,
+    cluster: str | None = Query(None, description="Only live patches applied to this cluster"),
+    since: datetime | None = None,
+    until: datetime | None = None,
+    cursor: int | None = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(50, ge=1, le=500)
+):
+    pat = get_token_from_cookie(request)
+    return audit.query(
+        flag=flag,
+        project=project,
+        env=env,
+        user=user,
+        cluster=cluster,
+        since=since.timestamp() if since else None,
+        until=until.timestamp() if until else None,
+        cursor=cursor,
+        limit=limit,
+        access=git_utils.get_access(pat),
+    )
+
+@app.get("/drift")
+def get_drift(
+    request: Request,
+    project: str | None = None,
+    env: str | None = None,
+    status: str | None = Query(None, pattern="^(drifted|missing_in_cluster|missing_in_git)$")
+):
+    pat = get_token_from_cookie(request)
+    return {
+        "ready": drift.is_ready(),
+        # False until the FeatureFlag watch has started (see K8S_WATCH) and listed the cluster
+        "cluster_synced": k8s_utils.watch_synced(),
+        "envs": drift.report(project=project, env=env, status=status,
+                             visible=git_utils.get_access(pat).can_see),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return metrics.render()
+
+@app.get("/debug/traces", dependencies=[Depends(require_admin)])
+def list_traces(limit: int = Query(50, ge=1, le=1000)):
+    return {"traces": tracing.recent(limit)}
+
+@app.get("/debug/traces/{trace_id}", dependencies=[Depends(require_admin)])
+def get_trace(trace_id: str):
+    trace = tracing.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found (it may have been evicted)")
+    return trace
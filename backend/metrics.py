@@ -0,0 +1,39 @@
+# backend/metrics.py
+from typing import Callable
+
+# Minimal Prometheus text exposition for GET /metrics. Modules register a
+# callback that returns either a number or {labels-tuple: number}; values are
+# read when /metrics is scraped, so registering costs nothing on the hot path.
+
+# name -> (type, help, label names, callback)
+_metrics: dict[str, tuple[str, str, tuple[str, ...], Callable]] = {}
+
+
+def register(name: str, kind: str, help: str, fn: Callable, labels: tuple[str, ...] = ()) -> None:
+    """
+    kind is "gauge" or "counter". With labels, fn returns {(label values...): value}.
+    """
+    _metrics[name] = (kind, help, labels, fn)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render() -> str:
+    lines = []
+    for name, (kind, help, labels, fn) in sorted(_metrics.items()):
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        try:
+            value = fn()
+        except Exception as e:
+            print(f"Metric {name} failed: {e}")
+            continue
+        if labels:
+            for label_values, sample in sorted(value.items()):
+                label_str = ",".join(f'{label}="{_escape(v)}"' for label, v in zip(labels, label_values))
+                lines.append(f"{name}{{{label_str}}} {sample}")
+        else:
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
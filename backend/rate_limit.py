@@ -0,0 +1,277 @@
+# backend/rate_limit.py
+import hashlib
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request
+import requests
+import metrics
+import tracing
+
+# ─── CONFIGURATION ────────────────────────────────────────────────────────────
+load_dotenv()
+GITLAB_API_BASE = os.environ.get("GITLAB_API_BASE", "https://gitlab.com/api/v4")
+# Default token bucket per (user, route): sustained requests/second and burst size.
+RATE_LIMIT_RPS = float(os.environ.get("RATE_LIMIT_RPS", "5"))
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", "20"))
+# Outbound GitLab calls: how many may run at once, how many may wait for a
+# slot, and how long (seconds) one waits before giving up with a 429.
+GITLAB_MAX_CONCURRENCY = int(os.environ.get("GITLAB_MAX_CONCURRENCY", "8"))
+GITLAB_MAX_QUEUE = int(os.environ.get("GITLAB_MAX_QUEUE", "32"))
+GITLAB_QUEUE_TIMEOUT = float(os.environ.get("GITLAB_QUEUE_TIMEOUT", "10"))
+# Reverse proxies in front of the app that append to X-Forwarded-For (1 behind
+# the ALB). The client address is the entry the outermost one appended; 0 uses
+# the TCP peer. Entries further left are set by the client and never trusted.
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", "0"))
+
+# Tighter limits for routes that fan out into many GitLab calls (rps, burst).
+ROUTE_LIMITS: dict[str, tuple[float, float]] = {
+    "GET /projects": (0.5, 5),
+    "GET /projects/{project}/envs": (1, 10),
+    "PUT /flags/{project}/{env}": (0.5, 5),
+    "POST /flags/{project}": (0.5, 5),
+    # Each needs the caller's project access (cached for a minute, see git_utils.get_access)
+    "GET /search/flags": (2, 10),
+    "GET /audit": (2, 10),
+    "GET /drift": (1, 5),
+    # Always limited per address (no token yet); sized for a few logins at once
+    "POST /oauth/callback": (2, 20),
+}
+# Probes and scrapes are never limited.
+EXEMPT_ROUTES = {"GET /", "GET /ready", "GET /metrics"}
+
+# Drop idle buckets once there are this many.
+_MAX_BUCKETS = 10000
+# How long a token -> GitLab username lookup is trusted (seconds).
+_IDENTITY_TTL = 300
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """
+        Take one token. Returns 0 on success, otherwise seconds until one is available.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+_buckets: dict[tuple[str, str], TokenBucket] = {}
+_buckets_mutex = threading.Lock()
+_rejected: dict[tuple[str], int] = {}
+# sha256(token) -> (GitLab username or None if GitLab rejected the token, expiry)
+_identities: dict[str, tuple[str | None, float]] = {}
+_identities_mutex = threading.Lock()
+
+
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _cached_identity(token_hash: str) -> tuple[bool, str | None]:
+    """
+    (known, username) for a token hash; known is False when it must be looked up.
+    """
+    with _identities_mutex:
+        entry = _identities.get(token_hash)
+    if entry is None or entry[1] < time.monotonic():
+        return False, None
+    return True, entry[0]
+
+
+def username_for_token(token: str) -> str | None:
+    """
+    GitLab username behind an access token, or None if GitLab rejects it (or
+    can't be asked right now). Answers are cached by token hash for _IDENTITY_TTL.
+    """
+    token_hash = _token_hash(token)
+    known, username = _cached_identity(token_hash)
+    if known:
+        return username
+    try:
+        with gitlab.slot():
+            response = requests.get(f"{GITLAB_API_BASE}/user",
+                                    headers={"Authorization": f"Bearer {token}"}, timeout=10)
+    except Exception as e:
+        print(f"Token lookup failed: {e}")
+        return None
+    if response.status_code == 200:
+        username = response.json().get("username")
+    elif response.status_code in (401, 403):
+        username = None
+    else:
+        return None
+
+    now = time.monotonic()
+    with _identities_mutex:
+        if len(_identities) >= _MAX_BUCKETS:
+            for key in [key for key, (_, expires) in _identities.items() if expires < now]:
+                del _identities[key]
+        _identities[token_hash] = (username, now + _IDENTITY_TTL)
+    return username
+
+
+def _client_address(request: Request) -> str:
+    if TRUSTED_PROXY_HOPS:
+        hops = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+        if len(hops) >= TRUSTED_PROXY_HOPS:
+            return hops[-TRUSTED_PROXY_HOPS]
+    return request.client.host if request.client else "unknown"
+
+
+def _client_key(request: Request) -> str:
+    """
+    Per authenticated user: the GitLab username behind the access token cookie,
+    once it has been verified. Anonymous requests, invalid tokens and tokens not
+    verified yet are limited per client address, so sending a fresh random
+    cookie on every request gains nothing.
+    """
+    token = request.cookies.get("access_token")
+    if token:
+        known, username = _cached_identity(_token_hash(token))
+        if known and username:
+            return "user:" + username
+    return "ip:" + _client_address(request)
+
+
+def _charge(client_key: str, route_key: str, rate: float, burst: float) -> None:
+    key = (client_key, route_key)
+    with _buckets_mutex:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            if len(_buckets) >= _MAX_BUCKETS:
+                _prune_buckets()
+            bucket = _buckets[key] = TokenBucket(rate, burst)
+        retry_after = bucket.take()
+        if retry_after:
+            _rejected[(route_key,)] = _rejected.get((route_key,), 0) + 1
+
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests, slow down.",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+
+def _prune_buckets() -> None:
+    # Caller holds _buckets_mutex. A bucket that has refilled completely
+    # behaves exactly like a new one, so it can be dropped.
+    now = time.monotonic()
+    for key, bucket in list(_buckets.items()):
+        if bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.capacity:
+            del _buckets[key]
+
+
+def check_rate_limit(request: Request) -> None:
+    """
+    FastAPI dependency: charge one token to the caller's bucket for this route,
+    or fail fast with 429 + Retry-After. A token seen for the first time is
+    charged to the client address and then verified with GitLab, so later
+    requests are charged to the user.
+    """
+    route = request.scope.get("route")
+    route_key = f"{request.method} {route.path if route else request.url.path}"
+    if route_key in EXEMPT_ROUTES:
+        return
+    rate, burst = ROUTE_LIMITS.get(route_key, (RATE_LIMIT_RPS, RATE_LIMIT_BURST))
+
+    client_key = _client_key(request)
+    _charge(client_key, route_key, rate, burst)
+    token = request.cookies.get("access_token")
+    if token and client_key.startswith("ip:"):
+        username_for_token(token)
+
+
+class ConcurrencyLimiter:
+    """
+    Caps concurrent calls to an upstream. Callers beyond the cap wait in a bounded
+    queue; when the queue is full, or the wait times out, they get a 429 instead
+    of piling up blocked threads.
+    """
+    def __init__(self, max_concurrency: int, max_queue: int, timeout: float):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+
+    def _reject(self) -> HTTPException:
+        self.rejected += 1
+        return HTTPException(
+            status_code=429,
+            detail="GitLab is busy, please retry shortly.",
+            headers={"Retry-After": "1"},
+        )
+
+    @contextmanager
+    def slot(self):
+        with self._cond:
+            if self.in_flight >= self.max_concurrency:
+                if self.waiting >= self.max_queue:
+                    raise self._reject()
+                self.waiting += 1
+                try:
+                    with tracing.span("gitlab queue wait", waiting=self.waiting):
+                        acquired = self._cond.wait_for(
+                            lambda: self.in_flight < self.max_concurrency, timeout=self.timeout
+                        )
+                finally:
+                    self.waiting -= 1
+                if not acquired:
+                    raise self._reject()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify()
+
+
+# Shared by every outbound GitLab call (see git_utils._gitlab_request).
+gitlab = ConcurrencyLimiter(GITLAB_MAX_CONCURRENCY, GITLAB_MAX_QUEUE, GITLAB_QUEUE_TIMEOUT)
+
+
+def _rejected_by_route() -> dict[tuple[str], int]:
+    with _buckets_mutex:
+        return dict(_rejected)
+
+
+metrics.register(
+    "featureflags_rate_limited_total", "counter",
+    "Requests rejected with 429 by the per-user rate limit",
+    _rejected_by_route, labels=("route",),
+)
+metrics.register(
+    "featureflags_gitlab_in_flight", "gauge",
+    "Outbound GitLab calls currently running",
+    lambda: gitlab.in_flight,
+)
+metrics.register(
+    "featureflags_gitlab_queue_depth", "gauge",
+    "Outbound GitLab calls waiting for a slot",
+    lambda: gitlab.waiting,
+)
+metrics.register(
+    "featureflags_gitlab_rejected_total", "counter",
+    "Outbound GitLab calls rejected because the queue was full or the wait timed out",
+    lambda: gitlab.rejected,
+)
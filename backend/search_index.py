@@ -0,0 +1,248 @@
+# backend/search_index.py
+import bisect
+import threading
+from typing import Callable
+import git_utils
+import change_feed
+
+# ─── INDEX ────────────────────────────────────────────────────────────────────
+#
+# A document is one flags file or CR:
+#   (project, None, "flags.yaml")          → {project}/flags.yaml
+#   (project, env,  "feature-flags.yaml")  → {project}/{env}/feature-flags.yaml
+#   (None,    env,  "cluster")             → the env's live FeatureFlag CR
+# (the project of a cluster document is looked up from the Git side at query time).
+#
+# Postings:
+#   flag name (lowercased) → {(doc, flag)}
+#   state                  → {(doc, flag)}
+#   variant key            → {(doc, flag)}
+# plus a sorted list of names for prefix queries and a trigram → names map
+# for substring queries.
+
+SOURCE_FLAGS = "flags.yaml"
+SOURCE_ENV = "feature-flags.yaml"
+SOURCE_CLUSTER = "cluster"
+
+_docs: dict[tuple, dict[str, dict]] = {}
+_name_postings: dict[str, set[tuple]] = {}
+_state_postings: dict[str, set[tuple]] = {}
+_variant_postings: dict[str, set[tuple]] = {}
+_sorted_names: list[str] = []
+_trigrams: dict[str, set[str]] = {}
+_env_projects: dict[str, str] = {}
+_index_mutex = threading.RLock()
+
+_ready = threading.Event()
+_started = False
+
+
+def _grams(name: str) -> set[str]:
+    return {name[i:i + 3] for i in range(len(name) - 2)}
+
+
+def _summarize(definition: dict) -> dict:
+    definition = definition if isinstance(definition, dict) else {}
+    variants = definition.get("variants")
+    return {
+        "state": definition.get("state"),
+        "defaultVariant": definition.get("defaultVariant"),
+        "variants": sorted(variants) if isinstance(variants, dict) else [],
+    }
+
+
+def _add_posting(postings: dict[str, set[tuple]], term, hit: tuple) -> None:
+    if term is None:
+        return
+    postings.setdefault(str(term), set()).add(hit)
+
+
+def _remove_posting(postings: dict[str, set[tuple]], term, hit: tuple) -> None:
+    if term is None:
+        return
+    hits = postings.get(str(term))
+    if hits is None:
+        return
+    hits.discard(hit)
+    if not hits:
+        del postings[str(term)]
+
+
+def _remove_doc(doc: tuple) -> None:
+    project, env, source = doc
+    if source == SOURCE_ENV and _env_projects.get(env) == project:
+        del _env_projects[env]
+    for flag, entry in _docs.pop(doc, {}).items():
+        hit = (doc, flag)
+        lowered = flag.lower()
+        _remove_posting(_name_postings, lowered, hit)
+        if lowered not in _name_postings:
+            i = bisect.bisect_left(_sorted_names, lowered)
+            if i < len(_sorted_names) and _sorted_names[i] == lowered:
+                del _sorted_names[i]
+            for gram in _grams(lowered):
+                _remove_posting(_trigrams, gram, lowered)
+        _remove_posting(_state_postings, entry["state"], hit)
+        for variant in entry["variants"]:
+            _remove_posting(_variant_postings, variant, hit)
+
+
+def index_document(project: str | None, env: str | None, source: str, flags: dict | None) -> None:
+    """
+    Replace one document in the index (flags=None removes it).
+    """
+    doc = (project, env, source)
+    with _index_mutex:
+        _remove_doc(doc)
+        if flags is None:
+            return
+        if project is not None and env is not None:
+            _env_projects[env] = project
+
+        entries = {flag: _summarize(definition) for flag, definition in flags.items()}
+        _docs[doc] = entries
+        for flag, entry in entries.items():
+            hit = (doc, flag)
+            lowered = flag.lower()
+            if lowered not in _name_postings:
+                bisect.insort(_sorted_names, lowered)
+                for gram in _grams(lowered):
+                    _add_posting(_trigrams, gram, lowered)
+            _add_posting(_name_postings, lowered, hit)
+            _add_posting(_state_postings, entry["state"], hit)
+            for variant in entry["variants"]:
+                _add_posting(_variant_postings, variant, hit)
+
+
+def _match_names(q: str, match: str) -> list[str]:
+    q = q.lower()
+    if match == "prefix":
+        start = bisect.bisect_left(_sorted_names, q)
+        end = bisect.bisect_left(_sorted_names, q + "\uffff")
+        return _sorted_names[start:end]
+
+    if len(q) < 3:
+        return [name for name in _sorted_names if q in name]
+    candidates = None
+    for gram in _grams(q):
+        names = _trigrams.get(gram, set())
+        candidates = names if candidates is None else candidates & names
+        if not candidates:
+            return []
+    return [name for name in candidates if q in name]
+
+
+def search(q: str | None = None, state: str | None = None, variant: str | None = None,
+           match: str = "substring", limit: int = 100,
+           visible: Callable[[str | None, str | None], bool] | None = None) -> list[dict]:
+    """
+    Find flags by name (prefix or substring, case-insensitive), state and/or variant key.
+    Returns up to limit hits sorted by project, env, source and flag, keeping only
+    documents for which visible(project, env) is true when it is given.
+    """
+    with _index_mutex:
+        hits = None
+        if q:
+            hits = set()
+            for name in _match_names(q, match):
+                hits |= _name_postings[name]
+        if state:
+            state_hits = _state_postings.get(state.upper(), set())
+            hits = set(state_hits) if hits is None else hits & state_hits
+        if variant:
+            variant_hits = _variant_postings.get(variant, set())
+            hits = set(variant_hits) if hits is None else hits & variant_hits
+        if hits is None:
+            hits = {(doc, flag) for doc, entries in _docs.items() for flag in entries}
+
+        results = []
+        seen_docs: dict[tuple, bool] = {}
+        for doc, flag in hits:
+            project, env, source = doc
+            if project is None:
+                project = _env_projects.get(env)
+            if visible is not None:
+                if doc not in seen_docs:
+                    seen_docs[doc] = visible(project, env)
+                if not seen_docs[doc]:
+                    continue
+            results.append({
+                "project": project,
+                "env": env,
+                "source": source,
+                "flag": flag,
+                **_docs[doc][flag],
+            })
+
+    results.sort(key=lambda r: (r["project"] or "", r["env"] or "", r["source"], r["flag"]))
+    return results[:limit]
+
+
+def is_ready() -> bool:
+    """
+    True once the initial build from the flags repo has finished.
+    """
+    return _ready.is_set()
+
+
+# ─── FOLLOWING GIT AND THE CLUSTER ────────────────────────────────────────────
+
+def _index_project(project: str) -> set[tuple]:
+    """
+    Index a project's Git documents; returns the document keys it covers.
+    """
+    pat = git_utils.FLAG_PAT
+    index_document(project, None, SOURCE_FLAGS, git_utils.read_project_flags(project, pat))
+    docs = {(project, None, SOURCE_FLAGS)}
+    for env in git_utils.get_all_envs(project, pat) or []:
+        index_document(project, env, SOURCE_ENV, git_utils.read_flags(project, env, pat))
+        docs.add((project, env, SOURCE_ENV))
+    return docs
+
+
+def _resync() -> None:
+    seen = set()
+    for project in git_utils.get_all_projects(git_utils.FLAG_PAT):
+        seen |= _index_project(project)
+    # Drop Git documents of projects and envs that no longer exist
+    with _index_mutex:
+        for doc in [doc for doc in _docs if doc[2] != SOURCE_CLUSTER and doc not in seen]:
+            _remove_doc(doc)
+    _ready.set()
+
+
+def _index_path(path: str, deleted: bool) -> None:
+    """
+    Re-index the document stored at a repo path that changed in a commit.
+    """
+    parts = path.split("/")
+    if len(parts) == 2 and parts[1] == "flags.yaml":
+        project, env, source = parts[0], None, SOURCE_FLAGS
+    elif len(parts) == 3 and parts[2] == "feature-flags.yaml" and parts[1] != "_template":
+        project, env, source = parts[0], parts[1], SOURCE_ENV
+    else:
+        return
+
+    if deleted:
+        index_document(project, env, source, None)
+    elif source == SOURCE_FLAGS:
+        index_document(project, env, source, git_utils.read_project_flags(project, git_utils.FLAG_PAT))
+    else:
+        index_document(project, env, source, git_utils.read_flags(project, env, git_utils.FLAG_PAT))
+
+
+def _index_cluster_event(event_type: str, env: str, flags: dict) -> None:
+    index_document(None, env, SOURCE_CLUSTER, None if event_type == "DELETED" else flags)
+
+
+def start() -> None:
+    """
+    Build the index in the background (via change_feed) and keep it current
+    from new commits on BRANCH and FeatureFlag watch events.
+    """
+    global _started
+    if _started:
+        return
+    _started = True
+    change_feed.subscribe_git(_resync, _index_path)
+    change_feed.subscribe_cluster(_index_cluster_event)
@@ -0,0 +1,161 @@
+# backend/snapshot.py
+import marshal
+import os
+import struct
+import threading
+import time
+import zlib
+from dotenv import load_dotenv
+import cache
+import git_utils
+import k8s_utils
+
+# ─── CONFIGURATION ────────────────────────────────────────────────────────────
+load_dotenv()
+# Where the cache snapshot lives. Point this at a volume that survives restarts.
+SNAPSHOT_PATH = os.environ.get("SNAPSHOT_PATH", "/var/cache/featureflags-ui/snapshot.bin")
+# Seconds between snapshot writes.
+SNAPSHOT_INTERVAL = float(os.environ.get("SNAPSHOT_INTERVAL", "60"))
+
+# ─── FILE FORMAT ──────────────────────────────────────────────────────────────
+#
+#   magic (8 bytes) | format version (uint16) | written_at (float64) | zlib(marshal(entries))
+#
+# entries is the list returned by cache.dump(): only builtins (tuples, dicts,
+# lists, str, int, bool), so a snapshot never needs YAML re-parsing on load.
+# marshal is used rather than pickle because it can only rebuild plain values:
+# whoever can write the volume must not be able to run code in the backend.
+# Entries marshal can't encode (e.g. a YAML timestamp parsed into a datetime)
+# are left out and simply fetched again after a restart.
+# Bump _FORMAT_VERSION whenever the cache key layout changes; older files are ignored.
+_MAGIC = b"FFUISNAP"
+_FORMAT_VERSION = 3
+_HEADER = struct.Struct(">8sHd")
+
+# ─── STATE ────────────────────────────────────────────────────────────────────
+
+_ready = threading.Event()
+_stop = threading.Event()
+_thread: threading.Thread | None = None
+
+
+def write(path: str = SNAPSHOT_PATH) -> int:
+    """
+    Write the current cache to path atomically (temp file + rename).
+    Returns the number of entries written.
+    """
+    entries = cache.dump()
+    try:
+        data = marshal.dumps(entries)
+    except ValueError:
+        entries = [entry for entry in entries if _marshallable(entry)]
+        data = marshal.dumps(entries)
+    payload = zlib.compress(data)
+    header = _HEADER.pack(_MAGIC, _FORMAT_VERSION, time.time())
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(payload)
+    os.replace(tmp_path, path)
+    return len(entries)
+
+
+def _marshallable(entry: tuple) -> bool:
+    try:
+        marshal.dumps(entry)
+        return True
+    except ValueError:
+        print(f"Snapshot: skipping cache entry {entry[0]!r} (not a plain value)")
+        return False
+
+
+def load(path: str = SNAPSHOT_PATH) -> int:
+    """
+    Load a snapshot written by write() into the cache.
+    Returns the number of entries loaded (0 if there is no usable snapshot).
+    """
+    try:
+        with open(path, "rb") as f:
+            blob = f.read()
+    except FileNotFoundError:
+        return 0
+
+    if len(blob) < _HEADER.size:
+        return 0
+    magic, version, _written_at = _HEADER.unpack_from(blob)
+    if magic != _MAGIC or version != _FORMAT_VERSION:
+        print(f"Ignoring snapshot {path}: unsupported format")
+        return 0
+
+    try:
+        entries = marshal.loads(zlib.decompress(blob[_HEADER.size:]))
+    except Exception as e:
+        print(f"Ignoring snapshot {path}: {e}")
+        return 0
+
+    cache.load(entries)
+    return len(entries)
+
+
+def is_ready() -> bool:
+    """
+    True once the warm load has finished (whether or not a snapshot existed).
+    """
+    return _ready.is_set()
+
+
+def _revalidate() -> None:
+    for revalidate in (git_utils.revalidate_cache, k8s_utils.revalidate_cache):
+        try:
+            revalidate()
+        except Exception as e:
+            print(f"Snapshot revalidation error: {e}")
+
+
+def _run() -> None:
+    try:
+        loaded = load()
+        print(f"Warm start: loaded {loaded} cache entries from {SNAPSHOT_PATH}")
+    except Exception as e:
+        loaded = 0
+        print(f"Warm start failed: {e}")
+    _ready.set()
+
+    if loaded:
+        _revalidate()
+
+    while not _stop.wait(SNAPSHOT_INTERVAL):
+        try:
+            write()
+        except Exception as e:
+            print(f"Snapshot write error: {e}")
+
+
+def start() -> None:
+    """
+    Load the snapshot and then keep writing one every SNAPSHOT_INTERVAL seconds,
+    all on a background thread so the server can start accepting requests.
+    """
+    global _thread
+    if _thread is not None:
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="cache-snapshot", daemon=True)
+    _thread.start()
+
+
+def stop() -> None:
+    """
+    Stop the background thread and write a final snapshot.
+    """
+    global _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout=5)
+        _thread = None
+    try:
+        write()
+    except Exception as e:
+        print(f"Snapshot write error: {e}")
@@ -0,0 +1,126 @@
+# backend/tests/test_evaluator.py
+import pytest
+import evaluator
+import git_utils
+import k8s_utils
+
+# Reference cases from flagd's targeting semantics: comparisons against a
+# missing or mismatched value are false rather than errors.
+
+THRESHOLD = {"if": [{">": [{"var": "n"}, 5]}, "on", "off"]}
+
+
+def flag(targeting=None, **overrides) -> evaluator.CompiledFlag:
+    definition = {"state": "ENABLED", "variants": {"on": True, "off": False}, "defaultVariant": "off"}
+    if targeting is not None:
+        definition["targeting"] = targeting
+    definition.update(overrides)
+    return evaluator.CompiledFlag("my-flag", definition)
+
+
+@pytest.mark.parametrize("context, variant", [
+    ({"n": 6}, "on"),
+    ({"n": 5}, "off"),
+    ({"n": "7"}, "on"),       # numeric strings are coerced against numbers
+    ({}, "off"),              # missing value: comparison is false
+    ({"n": None}, "off"),
+    ({"n": "abc"}, "off"),    # not a number: comparison is false
+    ({"n": [1]}, "off"),
+])
+def test_comparison(context, variant):
+    result = flag(THRESHOLD).evaluate(context)
+    assert (result["variant"], result["reason"]) == (variant, "TARGETING_MATCH")
+
+
+@pytest.mark.parametrize("rule, context, expected", [
+    ({"<": [1, {"var": "n"}, 10]}, {"n": 5}, True),
+    ({"<": [1, {"var": "n"}, 10]}, {"n": 10}, False),
+    ({"<=": [1, {"var": "n"}, 10]}, {"n": 10}, True),
+    ({"<": [1, {"var": "n"}, 10]}, {}, False),
+    ({">=": [{"var": "n"}, 5]}, {"n": 5}, True),
+    ({"<": [{"var": "s"}, "b"]}, {"s": "a"}, True),
+])
+def test_comparison_operators(rule, context, expected):
+    result = flag({"if": [rule, "on", "off"]}).evaluate(context)
+    assert result["value"] is expected
+
+
+@pytest.mark.parametrize("context, variant", [
+    ({"version": "1.2.3"}, "on"),
+    ({"version": "v2.0.0"}, "on"),
+    ({"version": "1.0.0"}, "off"),
+    ({"version": "1.2.0-rc.1"}, "off"),   # a pre-release sorts before its release
+    ({}, "off"),                          # missing version: false
+    ({"version": "not-a-version"}, "off"),
+])
+def test_sem_ver(context, variant):
+    rule = {"if": [{"sem_ver": [{"var": "version"}, ">=", "1.2.0"]}, "on", "off"]}
+    result = flag(rule).evaluate(context)
+    assert (result["variant"], result["reason"]) == (variant, "TARGETING_MATCH")
+
+
+def test_sem_ver_caret_and_tilde():
+    assert evaluator._sem_ver("1.9.0", "^", "1.2.0")
+    assert not evaluator._sem_ver("2.0.0", "^", "1.2.0")
+    assert evaluator._sem_ver("1.2.9", "~", "1.2.0")
+    assert not evaluator._sem_ver("1.3.0", "~", "1.2.0")
+
+
+def test_unknown_sem_ver_operator_is_a_parse_error():
+    rule = {"sem_ver": [{"var": "version"}, "%", "1.0.0"]}
+    assert flag(rule).evaluate({"version": "1.0.0"})["errorCode"] == "PARSE_ERROR"
+
+
+def test_reasons():
+    assert flag().evaluate({})["reason"] == "STATIC"
+    assert flag({"if": [False, "on", None]}).evaluate({})["reason"] == "DEFAULT"
+    assert flag(state="DISABLED").evaluate({})["errorCode"] == "FLAG_DISABLED"
+    assert flag(defaultVariant="missing").evaluate({})["errorCode"] == "PARSE_ERROR"
+    assert flag({"var": "group"}).evaluate({"group": ["a"]})["errorCode"] == "TYPE_MISMATCH"
+    assert flag({"var": "group"}).evaluate({"group": "nope"})["errorCode"] == "GENERAL"
+
+
+def test_string_operators():
+    rule = {"if": [{"ends_with": [{"var": "email"}, "@example.com"]}, "on", "off"]}
+    assert flag(rule).evaluate({"email": "a@example.com"})["variant"] == "on"
+    rule = {"if": [{"starts_with": [{"var": "email"}, "admin"]}, "on", "off"]}
+    assert flag(rule).evaluate({"email": "a@example.com"})["variant"] == "off"
+
+
+def test_murmur3_reference_values():
+    assert evaluator._murmur3_32(b"") == 0
+    assert evaluator._murmur3_32(b"hello") == 0x248BFA47
+    assert evaluator._murmur3_32(b"Hello, world!", 1234) == 0xFAF6CDB3
+
+
+def test_fractional_is_stable_per_targeting_key():
+    rule = {"fractional": [["on", 50], ["off", 50]]}
+    compiled = flag(rule)
+    variants = {compiled.evaluate({"targetingKey": f"user-{i}"})["variant"] for i in range(200)}
+    assert variants == {"on", "off"}
+    assert compiled.evaluate({"targetingKey": "user-1"}) == compiled.evaluate({"targetingKey": "user-1"})
+
+
+def test_evaluate_batch(monkeypatch):
+    backend = k8s_utils.FakeBackend([{
+        "metadata": {"name": k8s_utils._name("dev"), "namespace": k8s_utils._namespace("dev")},
+        "spec": {"flagSpec": {"flags": {"my-flag": {
+            "state": "ENABLED", "variants": {"on": True, "off": False}, "defaultVariant": "off",
+            "targeting": THRESHOLD,
+        }}}},
+    }])
+    monkeypatch.setattr(k8s_utils, "_backends", {k8s_utils.DEFAULT_CLUSTER: backend})
+    monkeypatch.setattr(git_utils, "get_all_envs", lambda project, pat: ["dev", "gone"] if project == "app" else None)
+
+    results = evaluator.evaluate_batch("app", [
+        ("dev", "my-flag", {"n": 9}),
+        ("dev", "missing-flag", {}),
+        ("gone", "my-flag", {}),     # env in Git but no CR
+        ("prod", "my-flag", {}),     # env of another project
+    ])
+    assert [(r["env"], r["flagKey"], r.get("variant"), r.get("errorCode")) for r in results] == [
+        ("dev", "my-flag", "on", None),
+        ("dev", "missing-flag", None, "FLAG_NOT_FOUND"),
+        ("gone", "my-flag", None, "GENERAL"),
+        ("prod", "my-flag", None, "GENERAL"),
+    ]
@@ -0,0 +1,284 @@
+# backend/tracing.py
+import collections
+import contextvars
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from typing import Awaitable, Callable
+from urllib.parse import parse_qs
+from dotenv import load_dotenv
+
+# ─── CONFIGURATION ────────────────────────────────────────────────────────────
+load_dotenv()
+# How many finished traces /debug/traces keeps (oldest are dropped first).
+TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE", "100"))
+# Seconds between stack samples when a CPU profile is requested.
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.005"))
+
+# Opt-in per-request tracing. A request that asks for it (see main.py) gets a
+# root Span; span() calls made while serving it add children, giving a tree of
+# upstream calls, YAML parses, lock waits and retry sleeps with their timings.
+# When no trace is active span() is a single ContextVar lookup returning a
+# shared no-op context manager.
+#
+# Context variables follow the request into FastAPI's thread pool; work handed
+# to other executors must be submitted with contextvars.copy_context().run.
+
+
+class Span:
+    __slots__ = ("name", "attrs", "start", "end", "children", "trace", "thread")
+
+    def __init__(self, name: str, attrs: dict, trace: "Trace"):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end = None
+        self.children: list[Span] = []
+        self.trace = trace
+        self.thread = threading.current_thread().name
+
+    def to_dict(self, origin: float) -> dict:
+        end = self.end if self.end is not None else time.perf_counter()
+        return {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round((end - self.start) * 1000, 3),
+            "thread": self.thread,
+            **({"attrs": self.attrs} if self.attrs else {}),
+            **({"children": [c.to_dict(origin) for c in self.children]} if self.children else {}),
+        }
+
+
+class Trace:
+    def __init__(self, name: str, attrs: dict):
+        self.id = uuid.uuid4().hex[:16]
+        self.created = time.time()
+        self.thread = threading.get_ident()
+        self.root = Span(name, attrs, self)
+        self.profile: collections.Counter | None = None
+
+    def to_dict(self) -> dict:
+        data = {
+            "id": self.id,
+            "created": self.created,
+            "root": self.root.to_dict(self.root.start),
+        }
+        if self.profile is not None:
+            # Collapsed stacks ("thread;outer;inner;leaf": samples), most frequent first
+            data["profile"] = {
+                "interval_ms": PROFILE_INTERVAL * 1000,
+                "samples": sum(self.profile.values()),
+                "stacks": dict(self.profile.most_common(50)),
+            }
+        return data
+
+
+_current: contextvars.ContextVar[Span | None] = contextvars.ContextVar("current_span", default=None)
+_noop = nullcontext()
+
+_buffer: collections.deque = collections.deque(maxlen=TRACE_BUFFER_SIZE)
+_buffer_mutex = threading.Lock()
+
+
+@contextmanager
+def _span(parent: Span, name: str, attrs: dict):
+    span = Span(name, attrs, parent.trace)
+    parent.children.append(span)
+    token = _current.set(span)
+    try:
+        yield span
+    finally:
+        span.end = time.perf_counter()
+        _current.reset(token)
+
+
+def span(name: str, **attrs):
+    """
+    `with tracing.span("GET /projects/:id", status=...) as s:` records a child span of
+    the current one, or does nothing when the request isn't traced. s is None when
+    not tracing; otherwise s.attrs can be updated inside the block.
+    """
+    parent = _current.get()
+    if parent is None:
+        return _noop
+    return _span(parent, name, attrs)
+
+
+@contextmanager
+def locked(lock: threading.Lock, name: str):
+    """
+    `with lock:` that records the time spent waiting for the lock as a span.
+    """
+    with span("lock wait", lock=name):
+        lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+def _sample(trace: Trace, stop: threading.Event) -> None:
+    # Python can't tell which worker thread will run the request, so every thread
+    # except the sampler and the event loop is sampled; span thread names show
+    # which ones belong to the request.
+    skip = {threading.get_ident(), trace.thread}
+    while not stop.wait(PROFILE_INTERVAL):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident in skip:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            trace.profile[";".join(reversed(stack))] += 1
+
+
+@contextmanager
+def trace_request(name: str, profile: bool = False, **attrs):
+    """
+    Trace everything done inside the block. The finished trace is stored in the
+    ring buffer; the Trace object is yielded so the caller can return it.
+    With profile=True, the process's threads are stack-sampled every
+    PROFILE_INTERVAL seconds while the block runs.
+    """
+    trace = Trace(name, attrs)
+    token = _current.set(trace.root)
+    sampler_stop = threading.Event()
+    sampler = None
+    if profile:
+        trace.profile = collections.Counter()
+        sampler = threading.Thread(target=_sample, args=(trace, sampler_stop), name="trace-profiler", daemon=True)
+        sampler.start()
+    try:
+        yield trace
+    finally:
+        sampler_stop.set()
+        if sampler is not None:
+            # The profile must not change while it is stored or serialised
+            sampler.join()
+        trace.root.end = time.perf_counter()
+        _current.reset(token)
+        with _buffer_mutex:
+            _buffer.append(trace)
+
+
+def recent(limit: int = 50) -> list[dict]:
+    """
+    Summaries of the most recent traces, newest first.
+    """
+    with _buffer_mutex:
+        traces = list(itertools.islice(reversed(_buffer), limit))
+    return [
+        {
+            "id": t.id,
+            "created": t.created,
+            "name": t.root.name,
+            "duration_ms": round(((t.root.end or time.perf_counter()) - t.root.start) * 1000, 3),
+            "spans": _count_spans(t.root),
+        }
+        for t in traces
+    ]
+
+
+def _count_spans(span: Span) -> int:
+    return 1 + sum(_count_spans(child) for child in span.children)
+
+
+def get(trace_id: str) -> dict | None:
+    with _buffer_mutex:
+        for t in _buffer:
+            if t.id == trace_id:
+                return t.to_dict()
+    return None
+
+
+# ─── ASGI MIDDLEWARE ──────────────────────────────────────────────────────────
+
+_MODES = {"1", "inline", "profile"}
+
+def _requested_modes(scope: dict) -> set[str] | None:
+    """
+    Modes asked for with the X-Debug-Trace header or the debug_trace query parameter,
+    e.g. "1", "inline", "profile" or "inline,profile". None when tracing wasn't asked
+    for; other values (e.g. "0" or "false") are ignored rather than turning it on.
+    """
+    value = None
+    for name, raw in scope.get("headers", []):
+        if name == b"x-debug-trace":
+            value = raw.decode("latin-1")
+            break
+    if value is None and b"debug_trace" in scope.get("query_string", b""):
+        value = parse_qs(scope["query_string"].decode("latin-1")).get("debug_trace", [None])[0]
+    if not value:
+        return None
+    modes = {mode.strip().lower() for mode in value.split(",")} & _MODES
+    return modes or None
+
+
+class TraceMiddleware:
+    """
+    Traces requests that ask for it, for callers that authorize(scope) accepts.
+    The trace id is returned in X-Trace-Id and the trace kept for /debug/traces;
+    with "inline", a JSON response is wrapped as {"response": ..., "trace": ...}.
+    Requests that don't ask only pay for the header check.
+    """
+    def __init__(self, app, authorize: Callable[[dict], Awaitable[bool]]):
+        self.app = app
+        self.authorize = authorize
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        modes = _requested_modes(scope)
+        if modes is None:
+            return await self.app(scope, receive, send)
+
+        if not await self.authorize(scope):
+            body = json.dumps({"detail": "Tracing is restricted to admins"}).encode()
+            await send({"type": "http.response.start", "status": 403,
+                        "headers": [(b"content-type", b"application/json"),
+                                    (b"content-length", str(len(body)).encode())]})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        inline = "inline" in modes
+        start_message = None
+        chunks = []
+
+        with trace_request(f"{scope['method']} {scope['path']}", profile="profile" in modes,
+                           query=scope.get("query_string", b"").decode("latin-1")) as trace:
+            async def send_wrapper(message):
+                nonlocal start_message
+                if message["type"] == "http.response.start":
+                    message = dict(message)
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", trace.id.encode())]
+                    trace.root.attrs["status"] = message["status"]
+                    if inline:
+                        start_message = message
+                        return
+                elif inline and message["type"] == "http.response.body":
+                    chunks.append(message.get("body", b""))
+                    return
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+
+        if not inline or start_message is None:
+            return
+
+        body = b"".join(chunks)
+        headers = [(k, v) for k, v in start_message["headers"] if k.lower() != b"content-length"]
+        content_type = dict((k.lower(), v) for k, v in headers).get(b"content-type", b"")
+        if content_type.startswith(b"application/json"):
+            body = json.dumps({"response": json.loads(body or b"null"), "trace": trace.to_dict()}).encode()
+        headers.append((b"content-length", str(len(body)).encode()))
+        await send({**start_message, "headers": headers})
+        await send({"type": "http.response.body", "body": body})